@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time series diagnostics for many series at once
+
+All functions take DataFrames with one series per column
+and work on all columns in a single vectorized pass.
+
+"""
+from __future__ import print_function, division
+
+import numpy as np
+import pandas as pd
+
+
+__all__ = ['log_returns', 'spread', 'acf', 'rolling_mean', 'rolling_var',
+           'rolling_acf']
+
+
+def log_returns(prices, periods=1):
+    """Log returns of price series.
+
+    """
+    return np.log(prices).diff(periods)
+
+
+def spread(left, right):
+    """Difference between two aligned series or matching columns of
+    two frames, e.g. RV - VIX.
+
+    """
+    left, right = left.align(right, join='inner')
+    return left - right
+
+
+def acf(data, nlags=40):
+    """Autocorrelation functions of all columns computed via FFT.
+
+    Missing values are replaced by the column mean, i.e. they do not
+    contribute to autocovariances. Normalization is the same as in
+    statsmodels.tsa.stattools.acf.
+
+    Parameters
+    ----------
+    data : DataFrame
+        One series per column
+    nlags : int
+        Number of lags
+
+    Returns
+    -------
+    DataFrame
+        Autocorrelations, lags in the index and series in columns
+
+    """
+    data = pd.DataFrame(data)
+    values = data.values.astype(float)
+    values = values - np.nanmean(values, axis=0)
+    values[np.isnan(values)] = 0
+    nobs = values.shape[0]
+    # Pad to avoid circular correlation
+    size = 2 ** int(np.ceil(np.log2(2 * nobs - 1)))
+    freq = np.fft.rfft(values, n=size, axis=0)
+    acov = np.fft.irfft(freq * np.conj(freq), n=size, axis=0)[:nlags+1]
+    return pd.DataFrame(acov / acov[0], columns=data.columns,
+                        index=pd.Index(np.arange(nlags+1), name='lag'))
+
+
+def _window_sums(values, window):
+    """Sums of valid values and their counts over rolling windows.
+
+    Sums come from cumulative sums, so each window costs O(1)
+    regardless of its length. Missing values are skipped and
+    do not affect other windows.
+
+    """
+    valid = ~np.isnan(values)
+    values = np.where(valid, values, 0)
+    shape = (min(window - 1, values.shape[0]), ) + values.shape[1:]
+    out = []
+    for data in [values, valid.astype(float)]:
+        csum = np.cumsum(data, axis=0)
+        csum = np.vstack([np.zeros((1, ) + data.shape[1:]), csum])
+        out.append(np.vstack([np.full(shape, np.nan),
+                              csum[window:] - csum[:-window]]))
+    return out
+
+
+def _min_count(counts, min_periods, window):
+    """Mask of windows with enough valid values.
+
+    """
+    if min_periods is None:
+        min_periods = window
+    return counts >= max(min_periods, 1)
+
+
+def rolling_mean(data, window, min_periods=None):
+    """Rolling means of all columns.
+
+    Missing values are skipped. Windows with fewer than min_periods
+    valid values (the whole window if None) are missing.
+
+    """
+    sums, counts = _window_sums(data.values.astype(float), window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(_min_count(counts, min_periods, window),
+                        sums / counts, np.nan)
+    return pd.DataFrame(mean, index=data.index, columns=data.columns)
+
+
+def rolling_var(data, window, min_periods=None):
+    """Rolling variances of all columns (with N - 1 degrees of freedom).
+
+    The series are demeaned first to keep the sums of squares accurate.
+    Missing values are treated as in rolling_mean.
+
+    """
+    values = data.values.astype(float)
+    values = values - np.nanmean(values, axis=0)
+    sums, counts = _window_sums(values, window)
+    squares = _window_sums(values ** 2, window)[0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var = (squares - sums ** 2 / counts) / (counts - 1)
+    var[~_min_count(counts, max(min_periods or window, 2), window)] = np.nan
+    return pd.DataFrame(var, index=data.index, columns=data.columns)
+
+
+def rolling_acf(data, window, lags=(1, ), min_periods=None):
+    """Rolling autocorrelations of all columns at several lags.
+
+    Autocorrelation at lag k is the correlation between the pairs
+    (x[t], x[t-k]) falling into the window. Pairs with a missing value
+    are skipped, windows with fewer than min_periods valid pairs
+    (all window - k pairs if None) are missing.
+
+    Returns
+    -------
+    DataFrame
+        Columns are (lag, series) pairs
+
+    """
+    for lag in lags:
+        if not 1 <= lag < window:
+            raise ValueError('Lag %r must be between 1 and window - 1 = %d'
+                             % (lag, window - 1))
+    values = data.values.astype(float)
+    values = values - np.nanmean(values, axis=0)
+    out = dict()
+    for lag in lags:
+        pairs = window - lag
+        head, tail = values[lag:], values[:-lag]
+        missing = np.isnan(head) | np.isnan(tail)
+        head = np.where(missing, np.nan, head)
+        tail = np.where(missing, np.nan, tail)
+        sxy, counts = _window_sums(head * tail, pairs)
+        sx = _window_sums(head, pairs)[0]
+        sy = _window_sums(tail, pairs)[0]
+        sxx = _window_sums(head ** 2, pairs)[0]
+        syy = _window_sums(tail ** 2, pairs)[0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = sxy - sx * sy / counts
+            var = (sxx - sx ** 2 / counts) * (syy - sy ** 2 / counts)
+            corr = cov / var ** .5
+        corr[~_min_count(counts, max(min_periods or pairs, 2), pairs)] \
+            = np.nan
+        corr = np.vstack([np.full((lag, values.shape[1]), np.nan), corr])
+        out[lag] = pd.DataFrame(corr, index=data.index, columns=data.columns)
+    return pd.concat(out, axis=1, names=['lag'])
@@ -17,8 +17,10 @@ import urllib
 
 import pandas as pd
 import numpy as np
-import matplotlib.pylab as plt
-import seaborn as sns
+
+from datastorage.report import figure
+from datastorage import storage
+from datastorage.validation import validate
 
 path = os.getenv("HOME") + '/Dropbox/Research/data/CBOE/data/'
 #__location__ = os.path.realpath(os.path.join(os.getcwd(),
@@ -52,20 +54,26 @@ def process_vix_data():
     raw = raw.applymap(lambda x: x if isinstance(x, float) else np.nan)
     # Subset data
     data = raw[['SPX', 'VIX']].dropna()
+    data = validate(data, 'vix_spx', path + 'vix_spx.h5', 'vix_spx')
 
-    data.to_hdf(path + 'vix_spx.h5', 'vix_spx')
+    storage.write(data, path + 'vix_spx.h5', 'vix_spx')
     print(data.head())
 
-    sns.set_context('paper')
-    data.plot(subplots=True)
-    plt.show()
-
 
-def load_vix_spx():
+def load_vix_spx(version=None):
     """Load CBOE VIX data from disk and check for sanity.
 
     """
-    return pd.read_hdf(path + 'vix_spx.h5', 'vix_spx')
+    return storage.read(path + 'vix_spx.h5', 'vix_spx', version=version)
+
+
+def figures():
+    """Figures of CBOE VIX data.
+
+    """
+    data = load_vix_spx()
+    return [figure('vix_spx', [data[['SPX']], data[['VIX']]],
+                   figsize=(10, 6))]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Command line interface
+
+Examples
+--------
+List datasets::
+
+    datastorage list
+
+Import several datasets in parallel::
+
+    datastorage import spx vix dividends --jobs 3
+
+Update statistics and inspect them::
+
+    datastorage update short_int_stats
+    datastorage inspect short_int_stats
+
+Export a date range to CSV::
+
+    datastorage export vix_spx vix_spx.csv --start 2000-01-01
+
+Export to a table of SQLite or DuckDB database, chosen by extension::
+
+    datastorage export returns research.duckdb
+
+"""
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing as mp
+
+import pandas as pd
+
+from datastorage import storage, progress, export
+from datastorage.datasets import datasets, locate, build, get_steps
+from datastorage.validation import previous_rows
+
+
+__all__ = ['main']
+
+
+def init_worker(inline):
+    """Report progress in the worker process.
+
+    """
+    progress.enabled = True
+    progress.inline = inline
+    if not inline:
+        progress.interval = 5
+
+
+def run_step(args):
+    """Build one dataset and report the time it took.
+
+    """
+    name, update = args
+    start = time.time()
+    build(name, update=update)
+    return name, time.time() - start
+
+
+def schedule(names):
+    """Split datasets into waves respecting requirements.
+
+    Datasets building the same way are built once. Requirements
+    are waited for only if they are built in the same run.
+
+    """
+    names = list(names)
+    for name in names:
+        if name not in datasets:
+            raise SystemExit('Unknown dataset %r. Available: %s'
+                             % (name, ', '.join(sorted(datasets))))
+    waves = []
+    done = set()
+    while names:
+        wave = [name for name in names
+                if not set(datasets[name].get('requires', []))
+                & (set(names) - set([name]))]
+        if not wave:
+            raise SystemExit('Circular requirements among %s' % names)
+        names = [name for name in names if name not in wave]
+        unique = []
+        for name in wave:
+            steps = get_steps(name)
+            if steps not in done:
+                done.add(steps)
+                unique.append(name)
+        waves.append(unique)
+    return waves
+
+
+def run_builds(names, update=False, jobs=1):
+    """Import or update datasets in waves, each wave in parallel.
+
+    """
+    for wave in schedule(names):
+        tasks = [(name, update) for name in wave]
+        if jobs == 1 or len(tasks) == 1:
+            init_worker(inline=sys.stderr.isatty())
+            results = [run_step(task) for task in tasks]
+        else:
+            pool = mp.Pool(min(jobs, len(tasks)), initializer=init_worker,
+                           initargs=(False, ))
+            try:
+                results = pool.map(run_step, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        for name, elapsed in results:
+            print('%s: done in %.1f s' % (name, elapsed))
+
+
+def list_datasets(args):
+    for name in sorted(datasets):
+        spec = datasets[name]
+        print('%-16s %-14s %s/%s' % (name, spec['module'], spec['file'],
+                                     spec['key']))
+
+
+def import_datasets(args):
+    run_builds(args.names, update=False, jobs=args.jobs)
+
+
+def update_datasets(args):
+    run_builds(args.names, update=True, jobs=args.jobs)
+
+
+def inspect_dataset(args):
+    fname, key = locate(args.name)
+    snapshot = storage.snapshot_name(fname, args.version)
+    print('File:     ', fname)
+    print('Key:      ', key)
+    print('Current:  ', storage.current_version(fname))
+    print('Versions: ', ', '.join(storage.versions(fname)))
+    print('Rows:     ', previous_rows(snapshot, key))
+    with pd.HDFStore(snapshot, mode='r') as store:
+        storer = store.get_storer(key)
+        print('Format:   ', 'table' if storer.is_table else 'fixed')
+        if storer.is_table:
+            head = store.select(key, stop=args.rows)
+        else:
+            head = store.select(key).head(args.rows)
+    print(head.dtypes)
+    print(head)
+
+
+def export_dataset(args):
+    columns = args.columns.split(',') if args.columns else None
+    kwargs = dict(columns=columns, start=args.start, end=args.end,
+                  version=args.version)
+    ext = os.path.splitext(args.output)[1].lower()
+    if ext in ['.db', '.sqlite']:
+        export.to_sqlite([args.name], args.output, **kwargs)
+    elif ext == '.duckdb':
+        export.to_duckdb([args.name], args.output, **kwargs)
+    else:
+        nrows = export.to_csv(args.name, args.output, **kwargs)
+        print('Exported %d rows to %s' % (nrows, args.output))
+        return
+    print('Exported %s to table %s of %s'
+          % (args.name, args.name, args.output))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='datastorage',
+        description='Import, update, inspect and export datasets.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    command = commands.add_parser('list', help='list datasets')
+    command.set_defaults(func=list_datasets)
+
+    for name, func, text in [('import', import_datasets,
+                              'import datasets from raw data'),
+                             ('update', update_datasets,
+                              'bring datasets up to date')]:
+        command = commands.add_parser(name, help=text)
+        command.add_argument('names', nargs='+', metavar='dataset')
+        command.add_argument('--jobs', '-j', type=int, default=1,
+                             help='number of datasets built in parallel')
+        command.set_defaults(func=func)
+
+    command = commands.add_parser('inspect', help='show stored dataset')
+    command.add_argument('name', metavar='dataset')
+    command.add_argument('--version', help='snapshot to inspect')
+    command.add_argument('--rows', type=int, default=5,
+                         help='number of rows to show')
+    command.set_defaults(func=inspect_dataset)
+
+    command = commands.add_parser(
+        'export', help='export dataset to CSV, SQLite or DuckDB')
+    command.add_argument('name', metavar='dataset')
+    command.add_argument('output',
+                         help='output file: .csv, .db/.sqlite or .duckdb')
+    command.add_argument('--columns', help='comma separated columns')
+    command.add_argument('--start', help='first date')
+    command.add_argument('--end', help='last date')
+    command.add_argument('--version', help='snapshot to export')
+    command.set_defaults(func=export_dataset)
+
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark compression codecs on stored datasets
+
+Every codec is measured on the actual data for compression ratio and
+write and read throughput. The recommended codec minimizes the time of
+loading the file over storage with the given bandwidth, i.e. the time
+of transferring compressed bytes plus the time of decompressing them.
+
+Example
+-------
+Choose compression of the volatility surface::
+
+    tune_compression('vol_surface', bandwidth=50)
+
+"""
+from __future__ import print_function, division
+
+import os
+import time
+import importlib.util
+import shutil
+import tempfile
+
+import pandas as pd
+
+from datastorage import storage
+from datastorage.datasets import locate
+
+
+__all__ = ['benchmark_compression', 'recommend_compression',
+           'tune_compression']
+
+# (complib, complevel) pairs of HDF5 codecs
+hdf_codecs = [(None, 0), ('zlib', 1), ('zlib', 5), ('bzip2', 5),
+              ('blosc:blosclz', 5), ('blosc:lz4', 5), ('blosc:lz4hc', 5),
+              ('blosc:zstd', 3), ('blosc:zstd', 9)]
+# Parquet codecs, measured only if pyarrow is installed
+parquet_codecs = [None, 'snappy', 'gzip', 'zstd', 'lz4']
+
+
+def best_time(func, repeat):
+    """Minimum wall time of several runs.
+
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def benchmark_hdf(data, fname, complib, complevel, repeat):
+
+    def write():
+        data.to_hdf(fname, 'data', mode='w', complib=complib,
+                    complevel=complevel)
+
+    def read():
+        pd.read_hdf(fname, 'data')
+
+    return best_time(write, repeat), best_time(read, repeat)
+
+
+def benchmark_parquet(data, fname, codec, repeat):
+
+    def write():
+        data.to_parquet(fname, compression=codec)
+
+    def read():
+        pd.read_parquet(fname)
+
+    return best_time(write, repeat), best_time(read, repeat)
+
+
+def benchmark_compression(data, repeat=3, parquet=True):
+    """Measure compression ratio and throughput of codecs on the data.
+
+    Parameters
+    ----------
+    data : DataFrame
+        Dataset to compress
+    repeat : int
+        Number of runs, the fastest one is reported
+    parquet : bool
+        Whether to include Parquet codecs (requires pyarrow)
+
+    Returns
+    -------
+    DataFrame
+        Columns:
+        format, codec, level : file format and codec
+        size : file size in bytes
+        ratio : size of uncompressed HDF5 file over file size
+        write, read : throughput in MB/s of uncompressed data
+
+    """
+    directory = tempfile.mkdtemp()
+    results = []
+    try:
+        fname = os.path.join(directory, 'data.h5')
+        for complib, complevel in hdf_codecs:
+            write, read = benchmark_hdf(data, fname, complib, complevel,
+                                        repeat)
+            results.append(('hdf', complib or 'none', complevel,
+                            os.path.getsize(fname), write, read))
+        if parquet and importlib.util.find_spec('pyarrow') is not None:
+            fname = os.path.join(directory, 'data.parquet')
+            for codec in parquet_codecs:
+                write, read = benchmark_parquet(data, fname, codec, repeat)
+                results.append(('parquet', codec or 'none', None,
+                                os.path.getsize(fname), write, read))
+    finally:
+        shutil.rmtree(directory)
+
+    results = pd.DataFrame(results, columns=['format', 'codec', 'level',
+                                             'size', 'write', 'read'])
+    raw = results['size'].iloc[0]
+    results['ratio'] = raw / results['size']
+    results['write'] = raw / results['write'] / 1e6
+    results['read'] = raw / results['read'] / 1e6
+    return results
+
+
+def recommend_compression(results, bandwidth=100):
+    """Choose HDF5 codec with the fastest load over the given bandwidth.
+
+    Parameters
+    ----------
+    results : DataFrame
+        Output of benchmark_compression
+    bandwidth : float
+        Storage bandwidth in MB/s
+
+    Returns
+    -------
+    complib : str or None
+    complevel : int
+
+    """
+    raw = results['size'].iloc[0] / 1e6
+    load = results['size'] / 1e6 / bandwidth + raw / results['read']
+    load[results['format'] != 'hdf'] = float('inf')
+    best = results.loc[load.idxmin()]
+    complib = None if best['codec'] == 'none' else best['codec']
+    return complib, int(best['level'])
+
+
+def tune_compression(name, bandwidth=100, repeat=3, nrows=10**6):
+    """Benchmark codecs on the dataset and configure the best one.
+
+    Parameters
+    ----------
+    name : str
+        Name of the dataset
+    bandwidth : float
+        Storage bandwidth in MB/s
+    repeat : int
+        Number of runs of each benchmark
+    nrows : int, optional
+        Number of leading rows to benchmark on. All rows if None
+
+    Returns
+    -------
+    DataFrame
+        Benchmark results
+
+    """
+    fname, key = locate(name)
+    # Only the benchmarked rows are read from the disk
+    data = storage.read(fname, key, stop=nrows)
+    results = benchmark_compression(data, repeat=repeat)
+    complib, complevel = recommend_compression(results, bandwidth=bandwidth)
+    storage.set_compression(fname, complib, complevel)
+
+    print(results)
+    print('Compression of %s set to %s, level %d'
+          % (fname, complib, complevel))
+    return results
+
+
+if __name__ == '__main__':
+
+    pd.set_option('float_format', '{:6.3f}'.format)
+
+    for name in ['returns', 'vol_surface', 'short_int']:
+        tune_compression(name)
@@ -10,15 +10,23 @@ import os
 import zipfile
 
 import datetime as dt
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+
+from datastorage.report import figure, render_all
+from datastorage import storage, progress
+from datastorage.validation import validate
 
 path = os.getenv("HOME") + '/Dropbox/Research/data/Compustat/data/'
 # __location__ = os.path.realpath(os.path.join(os.getcwd(),
 #                                 os.path.dirname(__file__)))
 # path = os.path.join(__location__, path + 'Compustat/data/')
 
+# Number of rows read from disk at once by the streaming aggregator
+chunksize = 10**6
+# Cross-sectional quantiles of short interest computed on each date
+quantiles = [.1, .25, .5, .75, .9]
+
 
 def date_convert(string):
     return dt.datetime.strptime(string, '%d-%m-%Y')
@@ -31,7 +39,7 @@ def import_data():
     zf = zipfile.ZipFile(path + 'short_int.zip', 'r')
     name = zf.namelist()[0]
 
-    short_int = pd.read_csv(zf.open(name),
+    short_int = pd.read_csv(progress.open_member(zf, name),
                             converters={'datadate': date_convert})
     columns = {'datadate': 'date',
                'SHORTINTADJ': 'short_int',
@@ -39,8 +47,17 @@ def import_data():
     short_int.rename(columns=columns, inplace=True)
     short_int.set_index(['gvkey', 'date'], inplace=True)
     short_int.sort_index(inplace=True)
+    short_int = validate(short_int, 'short_int', path + 'short_int.h5',
+                         'short_int')
 
-    short_int.to_hdf(path + 'short_int.h5', key='short_int')
+    # Date-ordered copy of the panel for the streaming aggregator
+    by_date = short_int.reset_index().sort_values(['date', 'gvkey'])
+    with storage.transaction(path + 'short_int.h5') as store:
+        store.put('short_int', short_int, format='table')
+        store.put('short_int_gvkey', storage.row_index(
+            short_int.index.get_level_values('gvkey')))
+        store.put('short_int_by_date', by_date, format='table',
+                  data_columns=['date'], index=False)
 
     print(short_int.head())
     print(short_int.dtypes)
@@ -53,50 +70,222 @@ def import_data():
           short_int.index.get_level_values('date').max().date())
 
 
-def load_data():
+def load_data(gvkey=None, version=None):
     """Load data from disk and check for sanity.
 
+    Parameters
+    ----------
+    gvkey : int or list-like of int, optional
+        Read only the rows of these companies. All companies if None
+    version : str, optional
+        Snapshot to read. The current one if None
+
     """
-    return pd.read_hdf(path + 'short_int.h5', 'short_int')
+    if gvkey is None:
+        return storage.read(path + 'short_int.h5', 'short_int',
+                            version=version)
+    if not pd.api.types.is_list_like(gvkey):
+        gvkey = [gvkey]
+    return storage.read_rows(path + 'short_int.h5', 'short_int',
+                             'short_int_gvkey', list(gvkey), version=version)
+
+
+def universe(dates, max_age=None, gvkey=None, short_int=None):
+    """Latest short interest of every company as of each date.
 
+    Every observation is the latest one for the snapshot dates from its
+    own date until the next observation of the same company. All
+    snapshots are found in one sorted pass over the (gvkey, date) panel.
 
-def count_companies(short_int):
-    """Plot number of companies over time.
+    Parameters
+    ----------
+    dates : list of dates
+        Snapshot dates
+    max_age : str, optional
+        Maximum age of the observation, e.g. '30D'.
+        Older observations are not included
+    gvkey : list of int, optional
+        Companies to include. All companies if None
+    short_int : DataFrame, optional
+        Panel sorted by (gvkey, date). Loaded from the disk if None,
+        filtered by gvkey otherwise
+
+    Returns
+    -------
+    DataFrame
+        Indexed by (date, gvkey) with the date of the observation
+        in 'obs_date' column
 
     """
-    df = short_int.reset_index().groupby('date')['gvkey'].nunique()
+    if short_int is None:
+        short_int = load_data(gvkey=gvkey)
+    elif gvkey is not None:
+        firms = short_int.index.get_level_values('gvkey')
+        short_int = short_int[firms.isin(np.atleast_1d(gvkey))]
+    dates = np.unique(pd.DatetimeIndex(dates).values)
+    snaps = dates.astype('datetime64[ns]').astype(np.int64)
+    firms = short_int.index.get_level_values('gvkey').values
+    obs = short_int.index.get_level_values('date').values
+    obs = obs.astype('datetime64[ns]').astype(np.int64)
+
+    # Observation is the latest one until the next one of the same company
+    until = np.append(obs[1:], 0)
+    until[np.append(firms[1:] != firms[:-1], True)] = np.iinfo(np.int64).max
+    if max_age is not None:
+        age = pd.Timedelta(max_age).value
+        until = np.minimum(until, obs + age + 1)
+
+    first = np.searchsorted(snaps, obs)
+    counts = np.maximum(np.searchsorted(snaps, until) - first, 0)
+    rows = np.repeat(np.arange(obs.shape[0]), counts)
+    # Position of every pair within the observation's run of snapshots
+    offset = np.arange(rows.shape[0]) - np.repeat(np.cumsum(counts) - counts,
+                                                  counts)
+    snapshot = np.repeat(first, counts) + offset
 
-    sns.set_context('paper')
+    data = short_int.iloc[rows].reset_index()
+    data.rename(columns={'date': 'obs_date'}, inplace=True)
+    data['date'] = dates[snapshot]
+    return data.set_index(['date', 'gvkey']).sort_index()
 
-    df.plot(figsize=(10, 3))
-    plt.show()
 
-    data = df.ix[dt.date(2006, 1, 1):dt.date(2007, 6, 30)]
-    data.plot(figsize=(10, 3))
-    plt.show()
+def iter_chunks_by_date(start=None, chunksize=chunksize):
+    """Iterate over the stored panel in date-ordered chunks.
 
+    Every chunk contains all observations of the dates it covers,
+    so that statistics computed on a chunk are final for these dates.
 
-def mean_short_int(short_int):
-    """Mean short interest on each date.
+    Parameters
+    ----------
+    start : date, optional
+        Only read dates strictly after this one
+    chunksize : int
+        Number of rows read from disk at once
 
     """
-    df = short_int.groupby(level='date')['short_int'].mean()
+    where = None
+    if start is not None:
+        where = "date > '%s'" % pd.Timestamp(start)
+    carry = None
+    with pd.HDFStore(path + 'short_int.h5', mode='r') as store:
+        for chunk in store.select('short_int_by_date', where=where,
+                                  chunksize=chunksize):
+            if carry is not None:
+                chunk = pd.concat([carry, chunk])
+            # The last date may continue in the next chunk
+            incomplete = (chunk['date'] == chunk['date'].iloc[-1]).values
+            carry = chunk[incomplete]
+            if not incomplete.all():
+                yield chunk[~incomplete]
+    if carry is not None and carry.shape[0] > 0:
+        yield carry
+
+
+def summarize_chunk(chunk):
+    """Cross-sectional statistics of short interest on each date.
 
-    sns.set_context('paper')
+    Columns:
+    companies : int
+        Number of unique companies
+    observed : int
+        Number of non-missing short interest observations
+    coverage : float
+        Share of companies with non-missing short interest
+    mean : float
+        Mean short interest
+    q10, q25, ... : float
+        Quantiles of short interest
 
-    df.plot(figsize=(10, 3))
-    plt.show()
+    """
+    grouped = chunk.groupby('date')
+    stats = pd.DataFrame({'companies': grouped['gvkey'].nunique(),
+                          'observed': grouped['short_int'].count()})
+    stats['coverage'] = stats['observed'] / stats['companies']
+    stats['mean'] = grouped['short_int'].sum() / stats['observed']
+    quant = grouped['short_int'].quantile(quantiles).unstack()
+    quant.columns = ['q%02d' % round(q * 100) for q in quant.columns]
+    return pd.concat([stats, quant], axis=1)
+
+
+def compute_stats(start=None, chunksize=chunksize):
+    """Compute statistics for each date streaming the panel from disk.
+
+    """
+    stats = [summarize_chunk(chunk)
+             for chunk in iter_chunks_by_date(start=start,
+                                              chunksize=chunksize)]
+    if len(stats) == 0:
+        return None
+    return pd.concat(stats)
+
+
+def import_stats(chunksize=chunksize):
+    """Compute statistics for all dates and save them to the disk.
+
+    """
+    stats = compute_stats(chunksize=chunksize)
+    storage.write(stats, path + 'short_int_stats.h5', 'short_int_stats',
+                  format='table')
 
-    df.ix[:dt.date(2004, 12, 31)].plot(figsize=(10, 3))
-    plt.show()
+    print(stats.head())
 
-    df.ix[dt.date(2006, 1, 1):dt.date(2007, 6, 30)].plot(figsize=(10, 3))
-    plt.show()
+
+def update_stats(chunksize=chunksize):
+    """Compute statistics only for the dates appended since the last run.
+
+    """
+    try:
+        last = load_stats().index.max()
+    except (KeyError, IOError):
+        return import_stats(chunksize=chunksize)
+    stats = compute_stats(start=last, chunksize=chunksize)
+    if stats is None:
+        print('No new dates after ', last.date())
+        return
+    storage.write(stats, path + 'short_int_stats.h5', 'short_int_stats',
+                  keep=True, format='table', append=True)
+
+    print('Appended statistics for ', stats.shape[0], ' dates')
+
+
+def load_stats(version=None):
+    """Load cross-sectional statistics from the disk.
+
+    Typical output:
+
+                companies  observed  coverage     mean  q10  q25 ...
+    date
+    1973-01-15        312       312     1.000  140.623  ...
+
+    """
+    return storage.read(path + 'short_int_stats.h5', 'short_int_stats',
+                        version=version)
+
+
+def count_companies(stats):
+    """Figures of number of companies over time.
+
+    """
+    df = stats[['companies']]
+    return [figure('companies', [df]),
+            figure('companies_2006',
+                   [df.loc[dt.date(2006, 1, 1):dt.date(2007, 6, 30)]])]
+
+
+def mean_short_int(stats):
+    """Figures of mean short interest on each date.
+
+    """
+    df = stats[['mean']]
+    return [figure('mean_short_int', [df]),
+            figure('mean_short_int_2004', [df.loc[:dt.date(2004, 12, 31)]]),
+            figure('mean_short_int_2006',
+                   [df.loc[dt.date(2006, 1, 1):dt.date(2007, 6, 30)]])]
 
 
 if __name__ == '__main__':
 
     import_data()
-    short_int = load_data()
-    count_companies(short_int)
-    mean_short_int(short_int)
+    import_stats()
+    stats = load_stats()
+    render_all(count_companies(stats) + mean_short_int(stats), '../plots')
@@ -11,16 +11,25 @@ from __future__ import print_function, division
 
 import os
 import zipfile
+import warnings
 
 import pandas as pd
 import datetime as dt
 import numpy as np
 
+from datastorage import storage, progress
+from datastorage.validation import validate, Validator, rules
+
 path = os.getenv("HOME") + '/Dropbox/Research/data/CRSP/data/'
 # __location__ = os.path.realpath(os.path.join(os.getcwd(),
 #                                 os.path.dirname(__file__)))
 # path = os.path.join(__location__, path + 'CRSP/data/')
 
+# Levels of SIC aggregation stored along with the firm panel
+sic_digits = [2, 3, 4]
+# Number of raw rows read at once
+chunksize = 10**6
+
 
 def convert_dates(string):
     """Convert dates from string to Python date format.
@@ -76,19 +85,18 @@ def import_returns():
     """
     # Import raw data
     zfile = zipfile.ZipFile(path + 'firm_returns.zip', 'r')
-    data = zfile.open(zfile.namelist()[0])
+    data = progress.open_member(zfile, zfile.namelist()[0])
     converters = {'DATE': convert_dates}
-    returns = pd.read_csv(data, converters=converters, engine='c')
-    # Rename columns
     columns = {'DATE': 'date', 'HSICCD': 'SIC',
                'PRC': 'price', 'SHROUT': 'shares',
                'RETX': 'return'}
-    returns.rename(columns=columns, inplace=True)
-    # Remove incorrect observations
-    cond1 = returns['return'] != 'C'
-    cond2 = returns['price'] > 0
-    cond3 = returns['shares'] > 0
-    returns = returns[cond1 & cond2 & cond3]
+    # Remove incorrect observations, e.g. 'C' returns, chunk by chunk
+    validator = Validator('returns_monthly', rules['returns_monthly'])
+    reader = pd.read_csv(data, converters=converters, engine='c',
+                         chunksize=chunksize)
+    returns = pd.concat([validator.check(chunk.rename(columns=columns))
+                         for chunk in reader])
+    validator.finish()
     # Convert to floats
     returns.loc[:, 'return'] = returns['return'].astype(float)
 
@@ -96,11 +104,20 @@ def import_returns():
 
     # Resample monthly returns to annual frequency
     returns = resample_returns(returns)
+    returns = validate(returns, 'returns', path + 'firm_returns.h5',
+                       'returns')
 
-    returns.to_hdf(path + 'firm_returns.h5', 'returns')
+    with storage.transaction(path + 'firm_returns.h5') as store:
+        store.put('returns', returns, format='table')
+        store.put('returns_cusip',
+                  storage.row_index(returns.index.get_level_values('CUSIP')))
+        # Mark the new build of the firm panel
+        store.get_storer('returns').attrs.build = dt.datetime.now().isoformat()
 
     print(returns.head())
 
+    build_industry_returns(returns)
+
 
 def resample_returns(returns):
     """Resample monthly returns to annual frequency.
@@ -130,11 +147,113 @@ def resample_returns(returns):
     return returns
 
 
-def load_returns():
+def aggregate_returns(returns, digits=2):
+    """Aggregate firm returns to SIC industries.
+
+    Parameters
+    ----------
+    returns : DataFrame
+        Annual firm returns as returned by resample_returns
+    digits : int
+        Number of leading SIC digits defining an industry
+
+    Typical output:
+              ew_return  vw_return        value  firms
+    SIC year
+    1   1983     12.204     15.573   613402.625     21
+        1984     -8.319     -3.005   712936.250     23
+
+    """
+    data = returns.reset_index()
+    data['SIC'] = data['SIC'] // 10 ** (4 - digits)
+    data['weighted'] = data['return'] * data['value']
+    grouped = data.groupby(['SIC', 'year'])
+    # Sums instead of means, see the note on top
+    sums = grouped[['return', 'weighted', 'value']].sum()
+    firms = grouped['CUSIP'].count()
+
+    industry = pd.DataFrame({'ew_return': sums['return'] / firms,
+                             'vw_return': sums['weighted'] / sums['value'],
+                             'value': sums['value'],
+                             'firms': firms})
+    return industry[['ew_return', 'vw_return', 'value', 'firms']]
+
+
+def build_industry_returns(returns=None):
+    """Compute industry returns at all SIC levels and save them to the disk.
+
+    The aggregates are tagged with the build of the firm panel
+    they were computed from.
+
+    """
+    if returns is None:
+        returns = load_returns()
+    build = get_build('firm_returns.h5', 'returns')
+    with storage.transaction(path + 'industry_returns.h5') as store:
+        for digits in sic_digits:
+            key = 'sic%d' % digits
+            industry = aggregate_returns(returns, digits)
+            store.put(key, industry)
+            store.get_storer(key).attrs.build = build
+
+            print(industry.head())
+
+
+def get_build(fname, key):
+    """Get the build tag of the stored table (None if there is no table).
+
+    """
+    try:
+        with pd.HDFStore(path + fname, mode='r') as store:
+            if key not in store:
+                return None
+            return getattr(store.get_storer(key).attrs, 'build', '')
+    except IOError:
+        return None
+
+
+def load_returns(cusip=None, version=None):
     """Load data from the disk.
 
+    Parameters
+    ----------
+    cusip : str or list-like of str, optional
+        Read only the rows of these firms. All firms if None
+    version : str, optional
+        Snapshot to read. The current one if None
+
+    """
+    if cusip is None:
+        return storage.read(path + 'firm_returns.h5', 'returns',
+                            version=version)
+    if not pd.api.types.is_list_like(cusip):
+        cusip = [cusip]
+    return storage.read_rows(path + 'firm_returns.h5', 'returns',
+                             'returns_cusip', list(cusip), version=version)
+
+
+def load_industry_returns(digits=2, version=None):
+    """Load industry returns from the disk.
+
+    The aggregates are rebuilt by import_returns. A warning is issued
+    if the firm panel has been rebuilt since they were computed.
+
+    Parameters
+    ----------
+    digits : int
+        Number of leading SIC digits defining an industry (2, 3, or 4)
+    version : str, optional
+        Snapshot to read. Pinned snapshots are not checked
+
     """
-    return pd.read_hdf(path + 'firm_returns.h5', 'returns')
+    if digits not in sic_digits:
+        raise ValueError('SIC level must be one of %s' % sic_digits)
+    key = 'sic%d' % digits
+    if version is None and (get_build('industry_returns.h5', key)
+                            != get_build('firm_returns.h5', 'returns')):
+        warnings.warn('Industry returns are older than the firm panel. '
+                      'Run build_industry_returns to update them.')
+    return storage.read(path + 'industry_returns.h5', key, version=version)
 
 
 if __name__ == '__main__':
@@ -142,3 +261,4 @@ if __name__ == '__main__':
     import_returns()
 
     returns = load_returns()
+    industry = load_industry_returns(digits=2)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Registry of stored datasets
+
+Every dataset is identified by a short name and points to the module
+responsible for it, the file inside the module data path, the key
+in the file, and the field with dates. Functions of the module listed
+in 'import' build the dataset from scratch, those in 'update' (if any)
+bring it up to date. 'requires' lists datasets which must be built
+before.
+
+"""
+from __future__ import print_function, division
+
+import importlib
+
+from datastorage import storage
+
+
+__all__ = ['datasets', 'locate', 'load', 'build']
+
+datasets = {
+    'vix_spx': {'module': 'cboe', 'file': 'vix_spx.h5',
+                'key': 'vix_spx', 'on': 'date',
+                'import': ['download_vix_data', 'process_vix_data']},
+    'realized_vol': {'module': 'oxfordman', 'file': 'realized_vol.h5',
+                     'key': 'realized_vol', 'on': 'date',
+                     'import': ['download_rv_data', 'process_rv_data']},
+    'rv_table': {'module': 'oxfordman', 'file': 'realized_vol.h5',
+                 'key': 'rv_table', 'on': 'date',
+                 'import': ['download_rv_data', 'process_rv_data']},
+    'spx': {'module': 'quandlweb', 'file': 'spx.h5',
+            'key': 'spx', 'on': 'date', 'import': ['import_spx']},
+    'vix': {'module': 'quandlweb', 'file': 'vix.h5',
+            'key': 'vix', 'on': 'date', 'import': ['import_vix']},
+    'ff_factors': {'module': 'quandlweb', 'file': 'ff_factors.h5',
+                   'key': 'ff_factors', 'on': 'year',
+                   'import': ['import_ff_factors_a']},
+    'dividends': {'module': 'optionmetrics', 'file': 'dividends.h5',
+                  'key': 'dividends', 'on': 'date',
+                  'import': ['import_dividends']},
+    'yields': {'module': 'optionmetrics', 'file': 'yields.h5',
+               'key': 'yields', 'on': 'date',
+               'import': ['import_yield_curve']},
+    'riskfree': {'module': 'optionmetrics', 'file': 'riskfree.h5',
+                 'key': 'riskfree', 'on': 'date',
+                 'import': ['import_riskfree'], 'requires': ['yields']},
+    'std_options': {'module': 'optionmetrics', 'file': 'std_options.h5',
+                    'key': 'std_options', 'on': 'date',
+                    'import': ['import_standard_options']},
+    'vol_surface': {'module': 'optionmetrics', 'file': 'surface.h5',
+                    'key': 'surface', 'on': 'date',
+                    'import': ['import_vol_surface_simple',
+                               'import_surface_cube'],
+                    'requires': ['spx', 'std_options']},
+    'returns': {'module': 'crsp', 'file': 'firm_returns.h5',
+                'key': 'returns', 'on': 'year',
+                'import': ['import_returns']},
+    'industry_sic2': {'module': 'crsp', 'file': 'industry_returns.h5',
+                      'key': 'sic2', 'on': 'year',
+                      'import': ['import_returns']},
+    'industry_sic3': {'module': 'crsp', 'file': 'industry_returns.h5',
+                      'key': 'sic3', 'on': 'year',
+                      'import': ['import_returns']},
+    'industry_sic4': {'module': 'crsp', 'file': 'industry_returns.h5',
+                      'key': 'sic4', 'on': 'year',
+                      'import': ['import_returns']},
+    'short_int': {'module': 'compustat', 'file': 'short_int.h5',
+                  'key': 'short_int', 'on': 'date',
+                  'import': ['import_data']},
+    'short_int_stats': {'module': 'compustat',
+                        'file': 'short_int_stats.h5',
+                        'key': 'short_int_stats', 'on': 'date',
+                        'import': ['import_stats'],
+                        'update': ['update_stats'],
+                        'requires': ['short_int']},
+    }
+
+
+def get_module(name):
+    """Import the module responsible for the dataset.
+
+    """
+    if name not in datasets:
+        raise KeyError('Unknown dataset %r. Available: %s'
+                       % (name, ', '.join(sorted(datasets))))
+    return importlib.import_module('datastorage.'
+                                   + datasets[name]['module'])
+
+
+def locate(name):
+    """File name and key of the dataset.
+
+    """
+    module = get_module(name)
+    return module.path + datasets[name]['file'], datasets[name]['key']
+
+
+def load(name, columns=None, start=None, end=None, version=None):
+    """Load the dataset through the storage layer.
+
+    Parameters
+    ----------
+    name : str
+        Name of the dataset
+    columns : list of str, optional
+        Columns to read. All columns if None
+    start, end : date, optional
+        First and last date to read (inclusive)
+    version : str, optional
+        Snapshot to read. The current one if None
+
+    """
+    fname, key = locate(name)
+    return storage.read(fname, key, columns=columns, start=start, end=end,
+                        on=datasets[name]['on'], version=version)
+
+
+def get_steps(name, update=False):
+    """Module and functions building the dataset.
+
+    """
+    spec = datasets[name]
+    funcs = spec['import']
+    if update:
+        funcs = spec.get('update', funcs)
+    return spec['module'], tuple(funcs)
+
+
+def build(name, update=False):
+    """Import or update the dataset.
+
+    """
+    module = get_module(name)
+    for func in get_steps(name, update=update)[1]:
+        getattr(module, func)()
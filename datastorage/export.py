@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Export stored datasets for SQL analytics
+
+Datasets are streamed from the storage in batches, so they are never
+materialized in memory as a whole. Tables are indexed on their natural
+keys, i.e. the index levels of the stored dataset.
+
+Examples
+--------
+Copy CRSP returns and the volatility surface to DuckDB::
+
+    to_duckdb(['returns', 'vol_surface'], 'research.duckdb')
+
+Query the surface in place, scanning Arrow record batches::
+
+    import duckdb
+    con = duckdb.connect()
+    attach_duckdb(con, ['vol_surface'])
+    con.execute('SELECT date, avg(imp_vol) FROM vol_surface GROUP BY date')
+
+"""
+from __future__ import print_function, division
+
+import sqlite3
+import itertools
+
+import pandas as pd
+
+from datastorage import storage
+from datastorage.datasets import datasets, locate
+
+
+__all__ = ['iter_batches', 'to_csv', 'to_sqlite', 'to_duckdb', 'to_arrow',
+           'attach_duckdb']
+
+# Number of rows per batch
+batch_size = 10**6
+
+
+def iter_batches(name, columns=None, start=None, end=None, version=None,
+                 chunksize=batch_size):
+    """Stream the dataset in batches with keys as columns.
+
+    Yields
+    ------
+    DataFrame
+        Batch with index levels turned into columns
+
+    """
+    fname, key = locate(name)
+    for batch in storage.read_batches(fname, key, columns=columns,
+                                      start=start, end=end,
+                                      on=datasets[name]['on'],
+                                      version=version, chunksize=chunksize):
+        yield flatten(batch)
+
+
+def flatten(batch):
+    """Turn named index levels into columns and drop unnamed ones.
+
+    """
+    if any(level is not None for level in batch.index.names):
+        return batch.reset_index()
+    return batch.reset_index(drop=True)
+
+
+def get_keys(name, batch, version=None):
+    """Natural keys of the dataset present in the batch.
+
+    """
+    fname, key = locate(name)
+    snapshot = storage.snapshot_name(fname, version)
+    with pd.HDFStore(snapshot, mode='r') as store:
+        names = store.select(key, stop=0).index.names
+    keys = [level for level in names if level is not None]
+    if not keys and datasets[name]['on'] in batch.columns:
+        keys = [datasets[name]['on']]
+    return [col for col in keys if col in batch.columns]
+
+
+def quote(name):
+    """Quote SQL identifier.
+
+    """
+    return '"%s"' % name.replace('"', '""')
+
+
+def to_csv(name, output, **kwargs):
+    """Stream the dataset to a CSV file.
+
+    Keyword arguments are passed to 'iter_batches'.
+
+    """
+    nrows = 0
+    for number, batch in enumerate(iter_batches(name, **kwargs)):
+        batch.to_csv(output, mode='w' if number == 0 else 'a',
+                     header=number == 0, index=False)
+        nrows += batch.shape[0]
+    return nrows
+
+
+def to_sqlite(names, database, **kwargs):
+    """Stream datasets to tables of an SQLite database.
+
+    Existing tables with the same names are replaced.
+
+    Parameters
+    ----------
+    names : list of str
+        Names of the datasets
+    database : str
+        Database file
+    kwargs : dict
+        Arguments of 'iter_batches'
+
+    """
+    con = sqlite3.connect(database)
+    try:
+        for name in names:
+            con.execute('DROP TABLE IF EXISTS %s' % quote(name))
+            keys = None
+            for batch in iter_batches(name, **kwargs):
+                if keys is None:
+                    keys = get_keys(name, batch, kwargs.get('version'))
+                batch.to_sql(name, con, if_exists='append', index=False)
+            if keys:
+                con.execute('CREATE INDEX %s ON %s (%s)'
+                            % (quote(name + '_keys'), quote(name),
+                               ', '.join(quote(key) for key in keys)))
+            con.commit()
+    finally:
+        con.close()
+
+
+def to_arrow(name, **kwargs):
+    """Expose the dataset as a stream of Arrow record batches.
+
+    The stream can be consumed once, e.g. scanned by DuckDB. An empty
+    selection gives an empty stream with the schema of the table.
+
+    Returns
+    -------
+    pyarrow.RecordBatchReader
+
+    """
+    import pyarrow as pa
+
+    batches = iter_batches(name, **kwargs)
+    try:
+        head = next(batches)
+    except StopIteration:
+        fname, key = locate(name)
+        head = flatten(storage.read(fname, key,
+                                    columns=kwargs.get('columns'),
+                                    version=kwargs.get('version'), stop=0))
+    first = pa.RecordBatch.from_pandas(head, preserve_index=False)
+    rest = (pa.RecordBatch.from_pandas(batch, schema=first.schema,
+                                       preserve_index=False)
+            for batch in batches)
+    return pa.RecordBatchReader.from_batches(first.schema,
+                                             itertools.chain([first], rest))
+
+
+def attach_duckdb(con, names, **kwargs):
+    """Register datasets in DuckDB as Arrow streams without copying.
+
+    Parameters
+    ----------
+    con : duckdb.DuckDBPyConnection
+        Connection to register the datasets in
+    names : list of str
+        Names of the datasets, used as view names
+    kwargs : dict
+        Arguments of 'iter_batches'
+
+    """
+    for name in names:
+        con.register(name, to_arrow(name, **kwargs))
+    return con
+
+
+def to_duckdb(names, database, **kwargs):
+    """Stream datasets to tables of a DuckDB database.
+
+    Existing tables with the same names are replaced.
+
+    Parameters
+    ----------
+    names : list of str
+        Names of the datasets
+    database : str
+        Database file
+    kwargs : dict
+        Arguments of 'iter_batches'
+
+    """
+    import duckdb
+
+    con = duckdb.connect(database)
+    try:
+        for name in names:
+            con.execute('DROP TABLE IF EXISTS %s' % quote(name))
+            keys = None
+            for batch in iter_batches(name, **kwargs):
+                con.register('batch', batch)
+                if keys is None:
+                    keys = get_keys(name, batch, kwargs.get('version'))
+                    con.execute('CREATE TABLE %s AS SELECT * FROM batch'
+                                % quote(name))
+                else:
+                    con.execute('INSERT INTO %s SELECT * FROM batch'
+                                % quote(name))
+                con.unregister('batch')
+            if keys:
+                con.execute('CREATE INDEX %s ON %s (%s)'
+                            % (quote(name + '_keys'), quote(name),
+                               ', '.join(quote(key) for key in keys)))
+    finally:
+        con.close()
@@ -6,7 +6,10 @@
 from __future__ import print_function, division
 
 import os
+import shutil
 import zipfile
+import tempfile
+import multiprocessing as mp
 
 import numpy as np
 import pandas as pd
@@ -16,12 +19,17 @@ from scipy.interpolate import interp1d
 
 from impvol import lfmoneyness, delta, vega
 from datastorage.quandlweb import load_spx
+from datastorage import storage, progress
+from datastorage.validation import validate
 
 path = os.getenv("HOME") + '/Dropbox/Research/data/OptionMetrics/data/'
 # __location__ = os.path.realpath(os.path.join(os.getcwd(),
 #                                 os.path.dirname(__file__)))
 # path = os.path.join(__location__, path + 'OptionMetrics/data/')
 
+# Moneyness grid of the dense volatility surface
+moneyness_grid = np.linspace(-.3, .3, 61)
+
 
 def convert_dates(string):
     return dt.datetime.strptime(string, '%d-%m-%Y')
@@ -33,14 +41,17 @@ def import_dividends():
     """
     zf = zipfile.ZipFile(path + 'SPX_dividend.zip', 'r')
     name = zf.namelist()[0]
-    dividends = pd.read_csv(zf.open(name), converters={'date': convert_dates})
+    dividends = pd.read_csv(progress.open_member(zf, name),
+                            converters={'date': convert_dates})
 
     dividends.set_index('date', inplace=True)
     dividends.sort_index(inplace=True)
+    dividends = validate(dividends, 'dividends', path + 'dividends.h5',
+                         'dividends')
 
     print(dividends.head())
 
-    dividends.to_hdf(path + 'dividends.h5', 'dividends')
+    storage.write(dividends, path + 'dividends.h5', 'dividends')
 
 
 def import_yield_curve():
@@ -49,20 +60,21 @@ def import_yield_curve():
     """
     zf = zipfile.ZipFile(path + 'yield_curve.zip', 'r')
     name = zf.namelist()[0]
-    yields = pd.read_csv(zf.open(name), converters={'date': convert_dates})
+    yields = pd.read_csv(progress.open_member(zf, name),
+                         converters={'date': convert_dates})
 
-    # Remove weird observations
-    yields = yields[yields['rate'] < 10]
     # Fill in the blanks in the yield curve
     # yields = interpolate_curve(yields)
 
     yields.rename(columns={'rate': 'riskfree'}, inplace=True)
     yields.set_index(['date', 'days'], inplace=True)
     yields.sort_index(inplace=True)
+    # Remove weird observations
+    yields = validate(yields, 'yields', path + 'yields.h5', 'yields')
 
     print(yields.head())
 
-    yields.to_hdf(path + 'yields.h5', 'yields')
+    storage.write(yields, path + 'yields.h5', 'yields')
 
 
 def interpolate_curve_group(group):
@@ -107,7 +119,7 @@ def import_riskfree():
 
     print(riskfree.head())
 
-    riskfree.to_hdf(path + 'riskfree.h5', 'riskfree')
+    storage.write(riskfree, path + 'riskfree.h5', 'riskfree')
 
 
 def import_standard_options():
@@ -116,14 +128,17 @@ def import_standard_options():
     """
     zf = zipfile.ZipFile(path + 'SPX_standard_options.zip', 'r')
     name = zf.namelist()[0]
-    data = pd.read_csv(zf.open(name), converters={'date': convert_dates})
+    data = pd.read_csv(progress.open_member(zf, name),
+                       converters={'date': convert_dates})
     cols = {'forward_price': 'forward', 'impl_volatility': 'imp_vol'}
     data.rename(columns=cols, inplace=True)
     data = data.set_index(['cp_flag', 'date', 'days']).sort_index()
+    data = validate(data, 'std_options', path + 'std_options.h5',
+                    'std_options')
 
     print(data.head())
 
-    data.to_hdf(path + 'std_options.h5', 'std_options')
+    storage.write(data, path + 'std_options.h5', 'std_options')
 
 
 def import_vol_surface():
@@ -133,7 +148,8 @@ def import_vol_surface():
     """
     zf = zipfile.ZipFile(path + 'SPX_surface.zip', 'r')
     name = zf.namelist()[0]
-    df = pd.read_csv(zf.open(name), converters={'date': convert_dates})
+    df = pd.read_csv(progress.open_member(zf, name),
+                     converters={'date': convert_dates})
     df.loc[:, 'weekday'] = df['date'].apply(lambda x: x.weekday())
 
     # Apply some filters
@@ -182,30 +198,17 @@ def import_vol_surface():
 
     print(surface.head())
 
-    surface.to_hdf(path + 'surface.h5', 'surface')
-
-
-def import_vol_surface_simple():
-    """Import volatility surface. Simple version.
-
-    """
-    zf = zipfile.ZipFile(path + 'SPX_surface.zip', 'r')
-    name = zf.namelist()[0]
-    df = pd.read_csv(zf.open(name), converters={'date': convert_dates})
-    df.loc[:, 'weekday'] = df['date'].apply(lambda x: x.weekday())
+    storage.write(surface, path + 'surface.h5', 'surface')
 
-    # Apply some filters
-    df = df[df['weekday'] == 2]
-    df = df[df['days'] <= 365]
-    surface = df.drop('weekday', axis=1)
 
-    cols = {'impl_volatility': 'imp_vol', 'impl_strike': 'strike',
-            'impl_premium': 'premium'}
-    surface.rename(columns=cols, inplace=True)
+def process_surface(surface, spx, standard_options):
+    """Derive all surface variables. Simple version.
 
-    spx = load_spx().reset_index()
-    standard_options = load_standard_options()[['forward']].reset_index()
+    All steps are independent across dates, so any date range of the
+    surface can be processed with matching slices of spx and
+    standard_options only.
 
+    """
     surface = pd.merge(surface, standard_options)
     surface = pd.merge(surface, spx)
 
@@ -237,12 +240,184 @@ def import_vol_surface_simple():
     # Sort index
     surface.sort_index(by=['date', 'maturity', 'moneyness'], inplace=True)
 
-    print(surface.head())
+    return surface
+
+
+def process_shard(args):
+    """Process one date shard of the surface and write it to the disk.
+
+    """
+    fname, surface, spx, standard_options = args
+    surface = process_surface(surface, spx, standard_options)
+    surface.to_hdf(fname, 'surface', mode='w')
+    return fname
+
+
+def split_dates(data, bounds):
+    """Split the frame into shards by the date column.
+
+    """
+    shard = np.searchsorted(bounds, data['date'].values, side='right') - 1
+    return dict(list(data.groupby(shard)))
+
+
+def import_vol_surface_simple(jobs=1, nshards=None):
+    """Import volatility surface. Simple version.
+
+    The surface is split into date shards which are processed in a pool
+    of processes. Each worker gets only the matching slices of spx and
+    standard_options and writes its output to a partition file in a
+    temporary directory of this run. The partitions are then appended
+    in date order to one table.
+
+    Parameters
+    ----------
+    jobs : int
+        Number of processes
+    nshards : int, optional
+        Number of date shards. Four per process by default
+
+    """
+    zf = zipfile.ZipFile(path + 'SPX_surface.zip', 'r')
+    name = zf.namelist()[0]
+    df = pd.read_csv(progress.open_member(zf, name),
+                     converters={'date': convert_dates})
+    df.loc[:, 'weekday'] = df['date'].apply(lambda x: x.weekday())
+
+    # Apply some filters
+    df = df[df['weekday'] == 2]
+    df = df[df['days'] <= 365]
+    surface = df.drop('weekday', axis=1)
+
+    cols = {'impl_volatility': 'imp_vol', 'impl_strike': 'strike',
+            'impl_premium': 'premium'}
+    surface.rename(columns=cols, inplace=True)
+
+    spx = load_spx().reset_index()
+    standard_options = load_standard_options()[['forward']].reset_index()
+
+    # First date of every shard
+    dates = np.unique(surface['date'].values)
+    if dates.shape[0] == 0:
+        raise ValueError('No surface observations left after filtering')
+    nshards = min(nshards or 4 * jobs, dates.shape[0])
+    bounds = np.array([part[0] for part in np.array_split(dates, nshards)])
+    no_spx, no_options = spx.iloc[:0], standard_options.iloc[:0]
+    surfaces = split_dates(surface, bounds)
+    spx = split_dates(spx, bounds)
+    standard_options = split_dates(standard_options, bounds)
+
+    # Partitions of this run only, removed even if the import fails
+    directory = tempfile.mkdtemp(prefix='surface_parts.', dir=path)
+    try:
+        tasks = ((os.path.join(directory, '%04d.h5' % shard),
+                  surfaces[shard], spx.get(shard, no_spx),
+                  standard_options.get(shard, no_options))
+                 for shard in sorted(surfaces))
+        if jobs == 1:
+            fnames = [process_shard(task) for task in tasks]
+        else:
+            pool = mp.Pool(jobs)
+            try:
+                fnames = list(pool.imap(process_shard, tasks))
+            finally:
+                pool.close()
+                pool.join()
+
+        # Append partitions in date order, numbering rows across
+        # partitions to keep the index unique
+        nrows = 0
+        with storage.transaction(path + 'surface.h5') as store:
+            for fname in fnames:
+                part = pd.read_hdf(fname, 'surface')
+                if part.shape[0] > 0:
+                    part.index = np.arange(nrows, nrows + part.shape[0])
+                    nrows += part.shape[0]
+                    store.append('surface', part, data_columns=['date'],
+                                 index=False)
+            if nrows == 0:
+                raise ValueError('No surface observations left after '
+                                 'merging with SPX and standard options')
+            store.create_table_index('surface', columns=['date'])
+
+            print(store.select('surface', stop=5))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def build_surface_cube(surface, grid=moneyness_grid, field='imp_vol'):
+    """Interpolate the sparse surface onto a dense grid.
+
+    Values are interpolated linearly in moneyness for each date and
+    maturity. Grid points outside of the observed moneyness range
+    are missing.
+
+    Parameters
+    ----------
+    surface : DataFrame
+        Volatility surface as returned by load_vol_surface
+    grid : array
+        Sorted moneyness grid
+    field : str
+        Column to interpolate
+
+    Returns
+    -------
+    cube : (ndates, ndays, ngrid) array
+    dates : (ndates, ) array
+    days : (ndays, ) array
+    grid : (ngrid, ) array
+
+    """
+    surface = surface.sort_values(['date', 'days', 'moneyness'])
+    dates = np.unique(surface['date'].values)
+    days = np.unique(surface['days'].values)
+    nrows = dates.shape[0] * days.shape[0]
+    # Position of each observation in the flattened (date, days) plane
+    row = (np.searchsorted(dates, surface['date'].values) * days.shape[0]
+           + np.searchsorted(days, surface['days'].values))
+    x = surface['moneyness'].values
+    y = surface[field].values
+    # Shift every row to its own interval on the line,
+    # so that one interpolation call covers all rows
+    span = max(x.max(), grid[-1]) - min(x.min(), grid[0]) + 1
+    shift = np.arange(nrows) * span
+    values = np.interp((shift[:, np.newaxis] + grid).ravel(),
+                       x + shift[row], y).reshape(nrows, grid.shape[0])
+    # Do not extrapolate outside of the observed range
+    lower = np.full(nrows, np.inf)
+    upper = np.full(nrows, -np.inf)
+    np.minimum.at(lower, row, x)
+    np.maximum.at(upper, row, x)
+    outside = ((grid < lower[:, np.newaxis])
+               | (grid > upper[:, np.newaxis]))
+    values[outside] = np.nan
+
+    cube = values.reshape(dates.shape[0], days.shape[0], grid.shape[0])
+    return np.ascontiguousarray(cube), dates, days, grid
+
+
+def import_surface_cube(grid=moneyness_grid, field='imp_vol'):
+    """Build dense volatility surface cube and save it to the disk.
+
+    The cube is saved as a contiguous array, so that a range of dates
+    can be read without loading the whole cube. The cube and its axes
+    are written to one snapshot directory which becomes current at once.
 
-    surface.to_hdf(path + 'surface.h5', 'surface')
+    """
+    surface = load_vol_surface()
+    cube, dates, days, grid = build_surface_cube(surface, grid=grid,
+                                                 field=field)
+    fname = path + 'surface_cube_' + field
+    with storage.directory_transaction(fname) as directory:
+        np.save(os.path.join(directory, 'cube.npy'), cube)
+        np.savez(os.path.join(directory, 'axes.npz'),
+                 dates=dates, days=days, grid=grid)
 
+    print('Surface cube of shape ', cube.shape)
 
-def load_dividends():
+
+def load_dividends(version=None):
     """Load dividends from the disk (annualized, percentage points).
 
     Typical output:
@@ -256,10 +431,10 @@ def load_dividends():
     1996-01-10  2.511
 
     """
-    return pd.read_hdf(path + 'dividends.h5', 'dividends')
+    return storage.read(path + 'dividends.h5', 'dividends', version=version)
 
 
-def load_yields():
+def load_yields(version=None):
     """Load zero yield curve from the disk (annualized, percentage points).
 
     Typical output:
@@ -272,10 +447,10 @@ def load_yields():
                78       5.609
                169      5.474
     """
-    return pd.read_hdf(path + 'yields.h5', 'yields')
+    return storage.read(path + 'yields.h5', 'yields', version=version)
 
 
-def load_riskfree():
+def load_riskfree(version=None):
     """Load risk-free rate (annualized, percentage points).
 
     Returns
@@ -294,10 +469,10 @@ def load_riskfree():
     1996-01-08     6.220
 
     """
-    return pd.read_hdf(path + 'riskfree.h5', 'riskfree')
+    return storage.read(path + 'riskfree.h5', 'riskfree', version=version)
 
 
-def load_standard_options():
+def load_standard_options(version=None):
     """Load standardized options from the disk.
 
     Typical output:
@@ -310,10 +485,11 @@ def load_standard_options():
                        152   625.545   18.259    0.116
 
     """
-    return pd.read_hdf(path + 'std_options.h5', 'std_options')
+    return storage.read(path + 'std_options.h5', 'std_options',
+                        version=version)
 
 
-def load_vol_surface():
+def load_vol_surface(version=None):
     """Load volatility surface from the disk.
 
     Typical output:
@@ -333,7 +509,105 @@ def load_vol_surface():
     8      0.082     0.032  False     -0.010 -0.401  0.111
 
     """
-    return pd.read_hdf(path + 'surface.h5', 'surface')
+    return storage.read(path + 'surface.h5', 'surface', version=version)
+
+
+def load_surface_cube(start=None, end=None, field='imp_vol',
+                      version=None):
+    """Load dense volatility surface cube for a range of dates.
+
+    Only the requested dates are read from the disk.
+
+    Parameters
+    ----------
+    start, end : date, optional
+        First and last date (inclusive)
+    field : str
+        Interpolated column
+    version : str, optional
+        Snapshot to read. The current one if None
+
+    Returns
+    -------
+    cube : (ndates, ndays, ngrid) array
+    dates : (ndates, ) array
+    days : (ndays, ) array
+    grid : (ngrid, ) array
+
+    """
+    # Resolve the snapshot once, so that the cube and its axes
+    # come from the same one
+    directory = os.path.realpath(
+        storage.snapshot_name(path + 'surface_cube_' + field, version))
+    with np.load(os.path.join(directory, 'axes.npz')) as axes:
+        dates, days, grid = axes['dates'], axes['days'], axes['grid']
+    first, last = 0, dates.shape[0]
+    if start is not None:
+        first = np.searchsorted(dates, np.datetime64(pd.Timestamp(start)))
+    if end is not None:
+        last = np.searchsorted(dates, np.datetime64(pd.Timestamp(end)),
+                               side='right')
+    cube = np.load(os.path.join(directory, 'cube.npy'), mmap_mode='r')
+    return np.array(cube[first:last]), dates[first:last], days, grid
+
+
+def bracket(axis, points):
+    """Left neighbours of points on the axis and interpolation weights.
+
+    Points outside of the axis get the value at the nearest end.
+
+    """
+    points = np.asarray(points, dtype=float)
+    left = np.clip(np.searchsorted(axis, points) - 1, 0, axis.shape[0] - 2)
+    weight = (points - axis[left]) / (axis[left + 1] - axis[left])
+    return left, np.clip(weight, 0, 1)
+
+
+def cube_bracket(days, grid, query_days, query_moneyness):
+    """Precompute bracketing index of query points on the cube axes.
+
+    The index can be reused for any slice of the cube.
+
+    Parameters
+    ----------
+    days, grid : array
+        Axes of the cube
+    query_days, query_moneyness : array
+        Coordinates of query points of the same shape
+
+    """
+    return (bracket(days.astype(float), query_days)
+            + bracket(grid, query_moneyness))
+
+
+def resample_cube(cube, index):
+    """Bilinear interpolation of the cube at query points for all dates.
+
+    Neighbours with zero weight are ignored, so points on the edge of
+    the observed range or clipped to the end of an axis are not
+    missing.
+
+    Parameters
+    ----------
+    cube : (ndates, ndays, ngrid) array
+        Dense volatility surface
+    index : tuple
+        Bracketing index as returned by cube_bracket
+
+    Returns
+    -------
+    (ndates, ) + shape of query points array
+
+    """
+    left_days, weight_days, left_grid, weight_grid = index
+    out = 0
+    for step_days, wdays in [(0, 1 - weight_days), (1, weight_days)]:
+        for step_grid, wgrid in [(0, 1 - weight_grid), (1, weight_grid)]:
+            weight = wdays * wgrid
+            value = cube[:, left_days + step_days, left_grid + step_grid]
+            # Neighbours with zero weight do not count even if missing
+            out = out + np.where(weight == 0, 0, weight * value)
+    return out
 
 
 if __name__ == '__main__':
@@ -345,7 +619,8 @@ if __name__ == '__main__':
 #    import_riskfree()
 #    import_standard_options()
 #    import_vol_surface()
-    import_vol_surface_simple()
+    import_vol_surface_simple(jobs=mp.cpu_count())
+    import_surface_cube()
 
 #    dividends = load_dividends()
 #    yields = load_yields()
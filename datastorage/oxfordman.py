@@ -24,10 +24,10 @@ import urllib
 import zipfile
 
 import pandas as pd
-import numpy as np
-import datetime as dt
-import matplotlib.pylab as plt
-import seaborn as sns
+
+from datastorage.report import figure
+from datastorage import storage, progress
+from datastorage.validation import validate
 
 path = os.getenv("HOME") + '/Dropbox/Research/data/OxfordMan/data/'
 # __location__ = os.path.realpath(os.path.join(os.getcwd(),
@@ -35,8 +35,10 @@ path = os.getenv("HOME") + '/Dropbox/Research/data/OxfordMan/data/'
 # path = os.path.join(__location__, 'OxfordMan/data/')
 
 
-def convert_dates(string):
-    return dt.datetime.strptime(str(int(string)), '%Y%m%d')
+# Realized measures in daily variance units which are annualized
+variance_measures = ['rv', 'rv5', 'rv10', 'rv5_ss', 'rv10_ss',
+                     'bv', 'bv_ss', 'rk', 'rk_th2', 'rk_twoscale',
+                     'rk_parzen', 'rsv', 'rsv_ss', 'medrv']
 
 
 def download_rv_data():
@@ -54,63 +56,149 @@ def download_rv_data():
     urllib.request.urlretrieve(url, path + fname)
 
 
-def import_rv(fname, skiprows, cols):
-    """Import RV from the file.
+def import_rv(fname, skiprows, sep):
+    """Import all realized measures from the file.
+
+    Vendor columns like 'SPX_rv' or 'SPX2.rv' are split at the separator
+    into (asset, measure) levels of the columns.
 
     """
     zf = zipfile.ZipFile(fname)
     name = zf.namelist()[0]
-    raw = pd.read_csv(zf.open(name), skiprows=skiprows)
+    raw = pd.read_csv(progress.open_member(zf, name), skiprows=skiprows)
     # Rename date column
     raw = raw.rename(columns={raw.columns[0]: 'date'})
     # Drop empty date rows
     raw.dropna(subset=['date'], inplace=True)
     # Convert date number to date format
-    raw['date'] = raw['date'].apply(convert_dates)
+    raw['date'] = pd.to_datetime(raw['date'].astype(int).astype(str),
+                                 format='%Y%m%d')
     # Reindex data
     raw.set_index('date', inplace=True)
-    # Subset data
-    return raw[cols].dropna()
+    # Keep only (asset, measure) columns
+    raw = raw[[col for col in raw.columns if sep in col]]
+    raw.columns = pd.MultiIndex.from_tuples(
+        [tuple(col.split(sep, 1)) for col in raw.columns],
+        names=['asset', 'measure'])
+    return raw.apply(pd.to_numeric, errors='coerce')
 
 
-def process_rv_data():
-    """Process and save OxfordMan RV data.
+def stitch_rv(rv1, rv2):
+    """Stitch two library versions for every (asset, measure).
+
+    The older version is used only before the first valid observation
+    of the same column in the newer version.
+
+    """
+    index = rv1.index.union(rv2.index)
+    columns = rv1.columns.union(rv2.columns)
+    rv1 = rv1.reindex(index=index, columns=columns)
+    rv2 = rv2.reindex(index=index, columns=columns)
+    started = rv2.notnull().cummax()
+    return rv1.where(~started, rv2)
+
+
+def build_rv_table():
+    """Build wide table of realized measures for all assets.
+
+    Variance measures are converted to annualized
+    standard deviations in percent.
+
+    Returns
+    -------
+    DataFrame
+        Columns are named '<asset>_<measure>', e.g. 'SPX_rv'
 
     """
     fname = path + 'realized.library.0.1.csv.zip'
-    skiprows = [0, ]
-    cols = ['SPX_rv']
-    rv1 = import_rv(fname, skiprows, cols)
+    rv1 = import_rv(fname, [0, ], '_')
 
     fname = path + 'oxfordmanrealizedvolatilityindices.zip'
-    skiprows = [0, 1]
-    cols = ['SPX2.rv']
-    rv2 = import_rv(fname, skiprows, cols)
-
-    rv1 = rv1.rename(columns={'SPX_rv': 'RV'})
-    rv2 = rv2.rename(columns={'SPX2.rv': 'RV'})
-    # Cut off the first data set
-    rv1 = rv1[rv1.index < np.array(rv2.index).min()]
-    # Concatenate
-    data = pd.concat([rv1, rv2], axis=0)
+    rv2 = import_rv(fname, [0, 1], '.')
+    # The vendor appends the library version to every asset name of
+    # the second library, e.g. 'SPX2'. Strip it only if all names follow
+    # this convention, so that the last digit of a ticker is kept
+    assets = rv2.columns.get_level_values('asset')
+    if assets.str.endswith('2').all():
+        rv2.columns = pd.MultiIndex.from_arrays(
+            [assets.str[:-1], rv2.columns.get_level_values('measure')],
+            names=['asset', 'measure'])
+
+    data = stitch_rv(rv1, rv2)
     # Convert to annualized standard deviations in percent
-    data['RV'] = (data['RV'] * 252) ** .5 * 100
-    data.sort_index(inplace=True)
+    variance = data.columns.get_level_values('measure').isin(
+        variance_measures)
+    data.loc[:, variance] = (data.loc[:, variance] * 252) ** .5 * 100
 
-    data.to_hdf(path + 'realized_vol.h5', 'realized_vol')
+    data.columns = ['_'.join(col) for col in data.columns]
+    return data.dropna(how='all').sort_index()
 
-    print(data.head())
 
-    sns.set_context('paper')
-    data.plot()
-    plt.show()
+def process_rv_data():
+    """Process and save OxfordMan RV data.
+
+    """
+    table = build_rv_table()
 
+    data = table[['SPX_rv']].rename(columns={'SPX_rv': 'RV'}).dropna()
+    data = validate(data, 'realized_vol', path + 'realized_vol.h5',
+                    'realized_vol')
 
-def load_realized_vol():
+    with storage.transaction(path + 'realized_vol.h5') as store:
+        store.put('rv_table', table, format='table', data_columns=True,
+                  index=False)
+        store.put('realized_vol', data)
+
+    print(data.head())
+
+
+def load_realized_vol(version=None):
     """Read OxfordMan RV data from disk and check for sanity.
 
     """
-    return pd.read_hdf(path + 'realized_vol.h5', 'realized_vol')
+    return storage.read(path + 'realized_vol.h5', 'realized_vol',
+                        version=version)
+
+
+def figures():
+    """Figures of OxfordMan RV data.
+
+    """
+    return [figure('realized_vol', [load_realized_vol()])]
+
+
+def load_rv_table(assets=None, measures=None, version=None):
+    """Read selected realized measures from the wide table.
+
+    Parameters
+    ----------
+    assets : list of str, optional
+        Asset names, e.g. ['SPX', 'FTSE']. All assets if None
+    measures : list of str, optional
+        Measure names, e.g. ['rv', 'bv']. All measures if None
+    version : str, optional
+        Snapshot to read. The current one if None
+
+    Typical output:
+
+                SPX_rv  SPX_bv
+    date
+    1996-01-02   6.728   6.320
+    1996-01-03   7.614   7.093
+
+    """
+    # Resolve the snapshot once for both reads
+    fname = os.path.realpath(storage.snapshot_name(path + 'realized_vol.h5',
+                                                   version))
+    columns = None
+    if assets is not None or measures is not None:
+        with pd.HDFStore(fname, mode='r') as store:
+            names = store.select('rv_table', stop=0).columns
+        split = [name.split('_', 1) for name in names]
+        columns = [name for name, (asset, measure) in zip(names, split)
+                   if (assets is None or asset in assets)
+                   and (measures is None or measure in measures)]
+    return storage.read(fname, 'rv_table', columns=columns)
 
 
 if __name__ == '__main__':
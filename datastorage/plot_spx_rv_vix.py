@@ -6,12 +6,10 @@ Plot SPX, logR, RV, VIX
 """
 from __future__ import print_function, division
 
-import matplotlib.pylab as plt
-import seaborn as sns
-import numpy as np
 import pandas as pd
-from statsmodels.tsa.stattools import acf
 
+from datastorage.analytics import log_returns, spread, acf
+from datastorage.report import figure, render_all
 from datastorage.oxfordman import load_realized_vol
 from datastorage.cboe import load_vix_spx
 
@@ -21,59 +19,37 @@ def load_data():
     realized_vol = load_realized_vol()
     vix_spx = load_vix_spx()
     data = pd.merge(realized_vol, vix_spx, left_index=True, right_index=True)
-    data['logR'] = data['SPX'].apply(np.log).diff(1)
+    data['logR'] = log_returns(data['SPX'])
     data.dropna(inplace=True)
     print(data.head())
     return data
 
 
 def plot_SPX_logR(data):
-    fig, axes = plt.subplots(nrows=2, ncols=1,
-                             sharex=True, figsize=(8, 6))
-    data['SPX'].plot(ax=axes[0])
-    data['logR'].plot(ax=axes[1])
-    axes[0].set_title('SPX')
-    axes[0].set_xlabel('')
-    axes[1].set_title('log(R)')
-    plt.savefig('../plots/SPX_logR.eps',
-                bbox_inches='tight', pad_inches=.05)
-    plt.show()
+    return figure('SPX_logR', [data['SPX'], data['logR']],
+                  titles=['SPX', 'log(R)'], figsize=(8, 6))
 
 
 def plot_RV_VIX(data):
-    fig, axes = plt.subplots(nrows=2, ncols=1,
-                             sharex=True, figsize=(8, 6))
-    data[['RV', 'VIX']].plot(ax=axes[0])
-    data['RV-VIX'] = data['RV'] - data['VIX']
-    data['RV-VIX'].plot(ax=axes[1])
-    axes[0].set_title('Volatility measures')
-    axes[0].set_xlabel('')
-    axes[1].set_title('Difference')
-    plt.savefig('../plots/RV_VIX.eps',
-                bbox_inches='tight', pad_inches=.05)
-    plt.show()
+    return figure('RV_VIX', [data[['RV', 'VIX']],
+                             spread(data['RV'], data['VIX'])],
+                  titles=['Volatility measures', 'Difference'],
+                  figsize=(8, 6))
 
 
 def plot_acf(data):
     nlags = 90
-    lw = 2
-    x = range(nlags+1)
+    series = pd.concat([data['VIX']**2, data['RV']**2, data['logR']],
+                       axis=1, keys=['VIX', 'RV', 'logR'])
+    autocorr = acf(series, nlags=nlags)
+    return figure('autocorr_logr_vix_rv', [autocorr], figsize=(6, 4),
+                  xlabel='Lags, days', grid=True)
 
-    plt.figure(figsize=(6, 4))
-    plt.plot(x, acf(data['VIX']**2, nlags=nlags), lw=lw, label='VIX')
-    plt.plot(x, acf(data['RV']**2, nlags=nlags), lw=lw, label='RV')
-    plt.plot(x, acf(data['logR'], nlags=nlags), lw=lw, label='logR')
-    plt.legend()
-    plt.xlabel('Lags, days')
-    plt.grid()
-    plt.savefig('../plots/autocorr_logr_vix_rv.eps',
-                bbox_inches='tight', pad_inches=.05)
-    plt.show()
+
+def figures():
+    data = load_data()
+    return [plot_SPX_logR(data), plot_RV_VIX(data), plot_acf(data)]
 
 
 if __name__ == '__main__':
-    sns.set_context('paper')
-    data = load_data()
-    plot_SPX_logR(data)
-    plot_RV_VIX(data)
-    plot_acf(data)
+    render_all(figures(), '../plots', fmt='eps')
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Progress of reading raw files
+
+Importers open raw files through 'open_member', which counts bytes and
+rows as they are consumed by the parser. Progress is reported only if
+enabled, e.g. by the command line interface.
+
+"""
+from __future__ import print_function, division
+
+import sys
+import time
+
+
+__all__ = ['ProgressReader', 'open_member']
+
+# Whether to report progress
+enabled = False
+# Whether to redraw one line instead of printing new ones,
+# which is not readable with several processes
+inline = True
+# Minimum number of seconds between two reports
+interval = .5
+
+
+class ProgressReader(object):
+    """File wrapper reporting rows and bytes per second.
+
+    Parameters
+    ----------
+    fobj : file
+        Binary file open for reading
+    total : int, optional
+        Total number of bytes
+    label : str
+        Name of the file in reports
+
+    """
+
+    def __init__(self, fobj, total=None, label=''):
+        self.fobj = fobj
+        self.total = total
+        self.label = label
+        self.nbytes = 0
+        self.nrows = 0
+        self.start = time.time()
+        self.last = 0
+        self.done = False
+
+    def __getattr__(self, name):
+        return getattr(self.fobj, name)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    next = __next__
+
+    def read(self, size=-1):
+        data = self.fobj.read(size)
+        self.update(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self.fobj.readline(size)
+        self.update(data)
+        return data
+
+    def update(self, data):
+        self.nbytes += len(data)
+        self.nrows += data.count(b'\n')
+        if not data and not self.done:
+            self.done = True
+            self.report(final=True)
+        elif data and time.time() - self.last > interval:
+            self.report()
+
+    def report(self, final=False):
+        """Print rows and bytes read so far and the throughput.
+
+        """
+        self.last = time.time()
+        elapsed = max(self.last - self.start, 1e-9)
+        line = '%s: %d rows %.1f MB, %d rows/s %.1f MB/s' \
+            % (self.label, self.nrows, self.nbytes / 1e6,
+               self.nrows / elapsed, self.nbytes / elapsed / 1e6)
+        if self.total:
+            share = min(self.nbytes / self.total, 1)
+            bar = '#' * int(share * 20)
+            line = '[%-20s] %3d%% %s' % (bar, share * 100, line)
+        if inline:
+            sys.stderr.write('\r' + line + ('\n' if final else ''))
+        else:
+            sys.stderr.write(line + '\n')
+        sys.stderr.flush()
+
+    def close(self):
+        self.fobj.close()
+
+
+def open_member(zfile, name):
+    """Open the member of the zip file, reporting progress if enabled.
+
+    """
+    fobj = zfile.open(name)
+    if not enabled:
+        return fobj
+    return ProgressReader(fobj, total=zfile.getinfo(name).file_size,
+                          label=name)
@@ -7,71 +7,258 @@ Import data from Quandl
 from __future__ import print_function, division
 
 import os
+import time
+import tempfile
+import threading
+import datetime as dt
+from multiprocessing.pool import ThreadPool
 
 import Quandl as ql
 import pandas as pd
 import pandas_datareader.data as web
-import matplotlib.pylab as plt
-import seaborn as sns
 
+from datastorage.report import figure
+from datastorage import storage
+from datastorage.validation import validate
 
-__all__ = ['import_spx', 'load_spx']
+
+__all__ = ['import_spx', 'load_spx', 'fetch']
 
 path = os.getenv("HOME") + '/Dropbox/Research/data/Quandl/data/'
 __location__ = os.path.realpath(os.path.join(os.getcwd(),
                                 os.path.dirname(__file__)))
 # path = os.path.join(__location__, path + 'Quandl/data/')
+cache_path = path + 'cache/'
 
+# Quandl codes of indices
+indices = {'spx': 'YAHOO/INDEX_GSPC', 'vix': 'YAHOO/INDEX_VIX'}
+# Minimum number of seconds between two requests to Quandl
+min_interval = .5
 
-def import_spx(plot=False):
-    """Import SPX prices.
+_token = None
+
+
+class RateLimiter(object):
+    """Keep a minimum interval between requests from several threads.
 
     """
-    token = open(os.path.join(__location__, 'Quandl.token')).read()
-    spx = ql.get("YAHOO/INDEX_GSPC", authtoken=token)[['Close']]
-    spx.rename(columns={'Close': 'spx'}, inplace=True)
-    spx.index.names = ['date']
 
-    print(spx.head())
-    spx.to_hdf(path + 'spx.h5', 'spx')
+    def __init__(self, interval):
+        self.interval = interval
+        self.last = 0
+        self.lock = threading.Lock()
 
-    if plot:
-        sns.set_context('paper')
-        spx.plot()
-        plt.show()
+    def wait(self):
+        """Block until the next request is allowed.
 
+        """
+        with self.lock:
+            delay = self.last + self.interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.last = time.time()
+
+
+def get_token():
+    """Read Quandl token from the disk once.
+
+    """
+    global _token
+    if _token is None:
+        with open(os.path.join(__location__, 'Quandl.token')) as fobj:
+            _token = fobj.read().strip()
+    return _token
 
-def import_vix(plot=False):
-    """Import VIX prices.
+
+def quandl_get(code, start=None, end=None):
+    """Request one code from Quandl.
 
     """
-    token = open(os.path.join(__location__, 'Quandl.token')).read()
-    vix = ql.get("YAHOO/INDEX_VIX", authtoken=token)[['Close']]
-    vix.rename(columns={'Close': 'vix'}, inplace=True)
-    vix.index.names = ['date']
+    return ql.get(code, authtoken=get_token(),
+                  trim_start=start, trim_end=end)
+
 
-    print(vix.head())
-    vix.to_hdf(path + 'vix.h5', 'vix')
+def local_getter(directory):
+    """Getter reading responses recorded by 'recording_getter'.
+
+    Allows to test fetching offline.
+
+    """
+    def getter(code, start=None, end=None):
+        fname = os.path.join(directory, code.replace('/', '_') + '.csv')
+        data = pd.read_csv(fname, index_col=0, parse_dates=True)
+        return data.loc[start:end]
+    return getter
 
-    if plot:
-        sns.set_context('paper')
-        vix.plot()
-        plt.show()
+
+def recording_getter(directory, getter=quandl_get):
+    """Getter saving every response to the directory.
+
+    """
+    def recorder(code, start=None, end=None):
+        data = getter(code, start=start, end=end)
+        fname = os.path.join(directory, code.replace('/', '_') + '.csv')
+        data.to_csv(fname)
+        return data
+    return recorder
+
+
+def cache_name(code):
+    return os.path.join(cache_path, code.replace('/', '_') + '.pkl')
+
+
+def read_cache(code):
+    """Read cached response and the date range it covers.
+
+    """
+    try:
+        return pd.read_pickle(cache_name(code))
+    except (IOError, EOFError):
+        return None, None, None
+
+
+def write_cache(code, data, start, end):
+    """Cache response covering dates from start to end.
+
+    """
+    if not os.path.isdir(cache_path):
+        os.makedirs(cache_path)
+    # Unique temporary file, so that concurrent writers do not collide
+    handle, temp = tempfile.mkstemp(suffix='.tmp', dir=cache_path)
+    os.close(handle)
+    try:
+        pd.to_pickle((data, start, end), temp)
+        os.replace(temp, cache_name(code))
+    except:
+        os.remove(temp)
+        raise
+
+
+def fetch_one(code, start=None, end=None, getter=quandl_get,
+              limiter=None, refresh=False):
+    """Fetch one code using the local cache.
+
+    Only the dates not covered by the cache are requested. The last
+    cached date is requested again in case it has been revised.
+
+    """
+    start = None if start is None else pd.Timestamp(start)
+    end = pd.Timestamp(end or dt.date.today())
+    cached, cached_start, cached_end = read_cache(code)
+
+    if cached is not None and cached_start is not None \
+            and (start is None or start < cached_start):
+        # Cache does not cover the beginning
+        cached = None
+    if cached is not None and cached_end >= end and not refresh:
+        return cached.loc[start:end]
+
+    tail_start = start
+    if cached is not None and cached.shape[0] > 0:
+        tail_start = cached.index.max()
+    if limiter is not None:
+        limiter.wait()
+    tail = getter(code, start=tail_start, end=end)
+
+    if cached is None:
+        data, cached_start = tail, start
+    elif tail.shape[0] == 0:
+        data = cached
+    else:
+        data = pd.concat([cached[cached.index < tail.index.min()], tail])
+    write_cache(code, data, cached_start, end)
+
+    return data.loc[start:end]
+
+
+def fetch(codes, start=None, end=None, getter=quandl_get, jobs=4,
+          interval=min_interval, refresh=False):
+    """Fetch many codes concurrently.
+
+    Parameters
+    ----------
+    codes : list of str
+        Quandl codes, e.g. ['YAHOO/INDEX_GSPC', 'YAHOO/INDEX_VIX']
+    start, end : date, optional
+        First and last date. Whole history until today by default
+    getter : callable
+        Function of (code, start, end) returning a DataFrame
+    jobs : int
+        Number of concurrent requests
+    interval : float
+        Minimum number of seconds between two requests
+    refresh : bool
+        Whether to request the last cached dates again even if
+        the cache covers the requested range
+
+    Returns
+    -------
+    dict
+        DataFrame for each code
+
+    """
+    limiter = RateLimiter(interval)
+
+    def fetch_code(code):
+        return fetch_one(code, start=start, end=end, getter=getter,
+                         limiter=limiter, refresh=refresh)
+
+    pool = ThreadPool(jobs)
+    try:
+        return dict(zip(codes, pool.map(fetch_code, codes)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def import_indices(names=('spx', 'vix'), getter=quandl_get, refresh=False):
+    """Import closing prices of indices in one batch.
+
+    """
+    codes = [indices[name] for name in names]
+    raw = fetch(codes, getter=getter, refresh=refresh)
+    for name in names:
+        data = raw[indices[name]][['Close']]
+        data = data.rename(columns={'Close': name})
+        data.index.names = ['date']
+        data = validate(data, name, path + name + '.h5', name)
+
+        print(data.head())
+        storage.write(data, path + name + '.h5', name)
+
+
+def import_spx():
+    """Import SPX prices.
+
+    """
+    import_indices(['spx'])
+
+
+def import_vix():
+    """Import VIX prices.
+
+    """
+    import_indices(['vix'])
 
 
 def import_ff_factors_a():
     """Import annual Fama-French factors.
 
+    The library serves the whole history in one file, so it is always
+    downloaded and written completely.
+
     """
-    factors = web.get_data_famafrench('F-F_Research_Data_Factors')[1]
+    factors = web.DataReader('F-F_Research_Data_Factors', 'famafrench',
+                             start='1926-01-01')[1]
     factors.columns = ['MKT', 'SMB', 'HML', 'RF']
-    factors.index.names = ['year']
+    # Integer years, like other annual datasets
+    factors.index = pd.Index(factors.index.year, name='year')
 
-    factors.to_hdf(path + 'ff_factors.h5', 'ff_factors')
+    storage.write(factors, path + 'ff_factors.h5', 'ff_factors')
     print(factors.head())
 
 
-def load_spx():
+def load_spx(version=None):
     """Load SPX index from the disk.
 
     Typical output:
@@ -85,10 +272,10 @@ def load_spx():
     1950-01-09 17.080
 
     """
-    return pd.read_hdf(path + 'spx.h5', 'spx')
+    return storage.read(path + 'spx.h5', 'spx', version=version)
 
 
-def load_vix():
+def load_vix(version=None):
     """Load VIX index from the disk.
 
     Typical output:
@@ -102,10 +289,10 @@ def load_vix():
     1990-01-08 20.260
 
     """
-    return pd.read_hdf(path + 'vix.h5', 'vix')
+    return storage.read(path + 'vix.h5', 'vix', version=version)
 
 
-def load_ff_factors_a():
+def load_ff_factors_a(version=None):
     """Load annual Fama-French factors.
 
     Typical output:
@@ -119,14 +306,20 @@ def load_ff_factors_a():
     1931 -45.110   3.530 -14.290  1.070
 
     """
-    return pd.read_hdf(path + 'ff_factors.h5', 'ff_factors')
+    return storage.read(path + 'ff_factors.h5', 'ff_factors', version=version)
+
+
+def figures():
+    """Figures of SPX and VIX indices.
+
+    """
+    return [figure('spx', [load_spx()]), figure('vix', [load_vix()])]
 
 
 if __name__ == '__main__':
 
     import_ff_factors_a()
     load_ff_factors_a()
-    import_spx()
+    import_indices()
     load_spx()
-    import_vix()
     load_vix()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Join datasets from different vendors on date
+
+Example
+-------
+Daily volatility surface with annual Fama-French factors::
+
+    data = query(['vol_surface', 'ff_factors'],
+                 columns={'vol_surface': ['date', 'days', 'imp_vol'],
+                          'ff_factors': ['MKT', 'RF']},
+                 start='2000-01-01', end='2005-12-31')
+
+"""
+from __future__ import print_function, division
+
+import numpy as np
+import pandas as pd
+
+from datastorage.datasets import datasets, locate, load
+
+
+__all__ = ['query']
+
+
+def get_columns(name, columns=None):
+    """Columns to read from the dataset including its date field.
+
+    """
+    on = datasets[name]['on']
+    if columns is None or on in columns:
+        return columns
+    fname, key = locate(name)
+    with pd.HDFStore(fname, mode='r') as store:
+        if on in store.select(key, stop=0).index.names:
+            return columns
+    return [on] + list(columns)
+
+
+def get_dates(data, on='date'):
+    """Dates of all rows of the frame, integer years for annual data.
+
+    """
+    if on == 'year':
+        if on in data.index.names:
+            return pd.Index(data.index.get_level_values(on))
+        raise ValueError('No year field in the data')
+    if on in data.columns:
+        return pd.DatetimeIndex(data[on])
+    if on in data.index.names:
+        return pd.DatetimeIndex(data.index.get_level_values(on))
+    if isinstance(data.index, pd.DatetimeIndex):
+        return data.index
+    raise ValueError('No date field %r in the data' % on)
+
+
+def align(data, dates, asof=False, tolerance=None):
+    """Align the dataset to the given dates.
+
+    Annual data (indexed by 'year') is broadcast to all dates of
+    the same year, or matched by year if dates are integer years.
+
+    Parameters
+    ----------
+    data : DataFrame
+        Dataset with unique sorted index of dates or years
+    dates : DatetimeIndex or Index of int
+        Target dates or years, neither unique nor sorted
+    asof : bool
+        Whether to take the last available observation on or
+        before each date instead of the exact match
+    tolerance : str, optional
+        Maximum distance to the last observation, e.g. '5D'
+
+    """
+    if data.index.names == ['year']:
+        if isinstance(data.index, pd.PeriodIndex):
+            data.index = pd.Index(data.index.year, name='year')
+        if isinstance(dates, pd.DatetimeIndex):
+            dates = dates.year
+        return data.reindex(dates)
+    if not isinstance(dates, pd.DatetimeIndex):
+        raise ValueError('Daily data can not be aligned to years')
+    data = data.sort_index()
+    if asof:
+        if tolerance is not None:
+            tolerance = pd.Timedelta(tolerance)
+        return data.reindex(dates, method='ffill', tolerance=tolerance)
+    return data.reindex(dates)
+
+
+def query(names, columns=None, start=None, end=None, how='left',
+          asof=False, tolerance=None, freq=None):
+    """Load several datasets and join them on date.
+
+    The first dataset defines the rows of the result, its date field
+    is always read. Other datasets must have a unique index of dates
+    (or years) and are aligned to the dates of the first one with a
+    sorted index lookup. If the first dataset is annual, other datasets
+    must be annual too and are matched by year.
+
+    Parameters
+    ----------
+    names : list of str
+        Names of the datasets
+    columns : dict, optional
+        Columns to read for each dataset name. All columns if None
+    start, end : date, optional
+        First and last date to read (inclusive)
+    how : str
+        'left' to keep all rows of the first dataset,
+        'inner' to keep only rows matched in every dataset
+    asof : bool
+        Whether to match the last available observation on or
+        before each date instead of the exact date
+    tolerance : str, optional
+        Maximum distance for as-of matching, e.g. '5D'
+    freq : str, optional
+        Frequency to convert the result to, e.g. 'M'.
+        The last observation in each period is taken
+
+    Returns
+    -------
+    DataFrame
+
+    """
+    if how not in ['left', 'inner']:
+        raise ValueError("Join type must be either 'left' or 'inner'")
+    columns = columns or dict()
+    names = list(names)
+    on = datasets[names[0]]['on']
+    data = load(names[0], columns=get_columns(names[0], columns.get(names[0])),
+                start=start, end=end)
+    if on in data.columns:
+        data = data.set_index(on)
+    dates = get_dates(data, on)
+    keep = np.ones(data.shape[0], dtype=bool)
+    if on == 'year' and freq is not None:
+        raise ValueError('Annual data can not be converted to %r' % freq)
+
+    for name in names[1:]:
+        first = start
+        if asof and start is not None and datasets[name]['on'] != 'year':
+            # Keep the last observation before the first date
+            first = None
+            if tolerance is not None:
+                first = pd.Timestamp(start) - pd.Timedelta(tolerance)
+        other = load(name, columns=columns.get(name), start=first, end=end)
+        aligned = align(other, dates, asof=asof, tolerance=tolerance)
+        if how == 'inner':
+            keep &= np.asarray(aligned.notnull().any(axis=1))
+        for col in aligned:
+            label = col if col not in data.columns else name + '_' + col
+            data[label] = aligned[col].values
+
+    if how == 'inner':
+        data = data[keep]
+    if freq is not None:
+        data = data.resample(freq).last()
+    return data
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Batch rendering of figures without a display
+
+Modules describe their figures with 'figure' and the report stage
+downsamples the data and renders all figures in a process pool.
+Figures are drawn on the Agg canvas directly, so importing the module
+does not change the matplotlib backend of the session.
+
+"""
+from __future__ import print_function, division
+
+import os
+import multiprocessing as mp
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import seaborn as sns
+import numpy as np
+import pandas as pd
+
+
+__all__ = ['figure', 'lttb', 'downsample', 'render', 'render_all',
+           'build_report']
+
+# Default number of points per series after downsampling
+max_points = 2000
+
+
+def figure(name, panels, titles=None, figsize=(10, 3), xlabel=None,
+           grid=False):
+    """Describe one figure.
+
+    Parameters
+    ----------
+    name : str
+        File name of the figure without extension
+    panels : list of DataFrame or Series
+        Data for each subplot. Every column is drawn as a line
+    titles : list of str, optional
+        Titles of subplots
+    figsize : tuple
+        Figure size in inches
+    xlabel : str, optional
+        Label of the horizontal axis
+    grid : bool
+        Whether to draw the grid
+
+    """
+    panels = [pd.DataFrame(panel) for panel in panels]
+    if titles is None:
+        titles = [None] * len(panels)
+    return {'name': name, 'panels': panels, 'titles': titles,
+            'figsize': figsize, 'xlabel': xlabel, 'grid': grid}
+
+
+def lttb(x, y, threshold):
+    """Largest-Triangle-Three-Buckets downsampling.
+
+    Parameters
+    ----------
+    x, y : array
+        Coordinates of the points, x sorted
+    threshold : int
+        Number of points to keep
+
+    Returns
+    -------
+    array
+        Positions of selected points
+
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    nobs = x.shape[0]
+    if threshold >= nobs or threshold < 3:
+        return np.arange(nobs)
+
+    every = (nobs - 2) / (threshold - 2)
+    bounds = (np.arange(threshold - 1) * every).astype(int) + 1
+    bounds[-1] = nobs - 1
+    sampled = np.empty(threshold, dtype=int)
+    sampled[0], sampled[-1] = 0, nobs - 1
+    prev = 0
+    for bucket in range(threshold - 2):
+        start, end = bounds[bucket], bounds[bucket + 1]
+        # Average point of the next bucket
+        if bucket == threshold - 3:
+            next_x, next_y = x[-1], y[-1]
+        else:
+            next_end = bounds[bucket + 2]
+            next_x = x[end:next_end].mean()
+            next_y = y[end:next_end].mean()
+        area = np.abs((x[prev] - next_x) * (y[start:end] - y[prev])
+                      - (x[prev] - x[start:end]) * (next_y - y[prev]))
+        prev = start + area.argmax()
+        sampled[bucket + 1] = prev
+    return sampled
+
+
+def downsample(data, threshold=max_points):
+    """Downsample every column of the frame with LTTB.
+
+    Rows selected for any of the columns are kept.
+
+    """
+    if data.shape[0] <= threshold:
+        return data
+    index = data.index
+    if isinstance(index, pd.DatetimeIndex):
+        x = index.asi8
+    else:
+        x = np.asarray(index, dtype=float)
+    keep = np.zeros(data.shape[0], dtype=bool)
+    for name in data:
+        valid = np.flatnonzero(data[name].notnull().values)
+        sampled = lttb(x[valid], data[name].values[valid], threshold)
+        keep[valid[sampled]] = True
+    return data[keep]
+
+
+def render(spec, outdir, fmt='pdf'):
+    """Render one figure to the file.
+
+    Returns
+    -------
+    str
+        Name of the written file
+
+    """
+    panels = spec['panels']
+    with sns.plotting_context('paper'):
+        fig = Figure(figsize=spec['figsize'])
+        FigureCanvasAgg(fig)
+        axes = fig.subplots(nrows=len(panels), ncols=1, sharex=True,
+                            squeeze=False)
+        for axis, panel, title in zip(axes[:, 0], panels, spec['titles']):
+            panel.plot(ax=axis)
+            if title is not None:
+                axis.set_title(title)
+            axis.set_xlabel('')
+            if spec['grid']:
+                axis.grid()
+        if spec['xlabel'] is not None:
+            axes[-1, 0].set_xlabel(spec['xlabel'])
+
+        fname = os.path.join(outdir, spec['name'] + '.' + fmt)
+        fig.savefig(fname, bbox_inches='tight', pad_inches=.05)
+    return fname
+
+
+def _render(args):
+    return render(*args)
+
+
+def render_all(figures, outdir, fmt='pdf', jobs=None, threshold=max_points):
+    """Downsample and render figures in parallel.
+
+    Parameters
+    ----------
+    figures : list of dict
+        Figures as described by 'figure'
+    outdir : str
+        Output directory, created if necessary
+    fmt : str
+        File format, e.g. 'pdf', 'png', or 'eps'
+    jobs : int, optional
+        Number of processes. All cores if None
+    threshold : int
+        Number of points per series after downsampling
+
+    Returns
+    -------
+    list of str
+        Names of written files
+
+    """
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    for spec in figures:
+        spec['panels'] = [downsample(panel, threshold)
+                          for panel in spec['panels']]
+    tasks = [(spec, outdir, fmt) for spec in figures]
+    if jobs == 1:
+        return [_render(task) for task in tasks]
+    pool = mp.Pool(jobs)
+    try:
+        return pool.map(_render, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def build_report(outdir, fmt='pdf', jobs=None):
+    """Render figures of all stored datasets.
+
+    """
+    from datastorage import (cboe, oxfordman, compustat, quandlweb,
+                             plot_spx_rv_vix)
+
+    figures = cboe.figures() + oxfordman.figures() + quandlweb.figures()
+    stats = compustat.load_stats()
+    figures += compustat.count_companies(stats)
+    figures += compustat.mean_short_int(stats)
+    figures += plot_spx_rv_vix.figures()
+
+    for fname in render_all(figures, outdir, fmt=fmt, jobs=jobs):
+        print(fname)
+
+
+if __name__ == '__main__':
+
+    build_report('../plots')
@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reading and writing stored HDF5 datasets
+
+Tables stored in 'table' format are filtered on disk, so only the
+requested columns and dates are read. Tables in 'fixed' format are
+read completely and filtered in memory.
+
+Every write creates a new immutable snapshot of the file in the
+'<file>.versions' directory. The file itself is a symbolic link to the
+current snapshot which is swapped atomically after the snapshot is
+complete. Readers opening the file get either the old or the new
+snapshot, never a partially written one, and can pin a snapshot by its
+version. Several writers never write to the same file, the last one
+to finish becomes current. Groups of non-HDF5 files are versioned the
+same way as snapshot directories.
+
+Panels sorted by a firm identifier can be stored with a row index
+mapping every identifier to its contiguous row ranges, so that the
+rows of a few firms are read directly from a 'table' format store.
+
+New snapshots are compressed with the codec configured for the file in
+'compression.json' of its directory, see datastorage.compression.
+
+"""
+from __future__ import print_function, division
+
+import os
+import json
+import shutil
+import datetime as dt
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+
+__all__ = ['read', 'write', 'transaction', 'directory_transaction',
+           'versions', 'current_version', 'get_compression',
+           'set_compression', 'row_index', 'read_rows', 'read_batches']
+
+# Number of snapshots kept for every file
+keep_versions = 5
+# Compression (complib, complevel) of files without configuration
+default_compression = ('blosc:lz4', 5)
+# Name of the file with compression settings in each data directory
+compression_file = 'compression.json'
+
+
+def _bounds(start, end, on):
+    """Convert date bounds to the type of the filtering field.
+
+    """
+    if on == 'year':
+        start = None if start is None else pd.Timestamp(start).year
+        end = None if end is None else pd.Timestamp(end).year
+    else:
+        start = None if start is None else pd.Timestamp(start)
+        end = None if end is None else pd.Timestamp(end)
+    return start, end
+
+
+def _where(store, key, on, start, end):
+    """Build the query selecting rows between start and end.
+
+    Returns None if the field can not be queried on disk.
+
+    """
+    storer = store.get_storer(key)
+    empty = store.select(key, stop=0)
+    if on in (storer.data_columns or []):
+        field = on
+    elif empty.index.names == [on]:
+        field = 'index'
+    else:
+        return None
+    fmt = "%s %s %d" if on == 'year' else "%s %s '%s'"
+    where = []
+    if start is not None:
+        where.append(fmt % (field, '>=', start))
+    if end is not None:
+        where.append(fmt % (field, '<=', end))
+    return where
+
+
+def _select(data, on, start, end):
+    """Select rows between start and end in memory.
+
+    """
+    if on in data.columns:
+        values = data[on]
+    elif on in data.index.names:
+        values = data.index.get_level_values(on)
+    else:
+        return data
+    keep = np.ones(data.shape[0], dtype=bool)
+    if start is not None:
+        keep &= np.asarray(values >= start)
+    if end is not None:
+        keep &= np.asarray(values <= end)
+    return data[keep]
+
+
+def versions_dir(fname):
+    return fname + '.versions'
+
+
+def snapshot_name(fname, version=None):
+    """File name of the snapshot. The current one if version is None.
+
+    Snapshots keep the extension of the file, directories have none.
+
+    """
+    if version is None:
+        return fname
+    return os.path.join(versions_dir(fname),
+                        version + os.path.splitext(fname)[1])
+
+
+def _version(fname, name):
+    """Version of the snapshot file name, None for other files.
+
+    """
+    ext = os.path.splitext(fname)[1]
+    if name.endswith('.tmp') or not name.endswith(ext):
+        return None
+    return name[:len(name) - len(ext)]
+
+
+def versions(fname):
+    """Available snapshot versions from the oldest to the newest.
+
+    """
+    directory = versions_dir(fname)
+    if not os.path.isdir(directory):
+        return []
+    found = [_version(fname, name) for name in os.listdir(directory)]
+    return sorted(version for version in found if version is not None)
+
+
+def current_version(fname):
+    """Version of the current snapshot. None for a plain file.
+
+    """
+    if not os.path.islink(fname):
+        return None
+    return _version(fname, os.path.basename(os.readlink(fname)))
+
+
+def prune(fname, keep=keep_versions):
+    """Remove old snapshots except for the current one.
+
+    Readers having a removed snapshot open can still finish reading it.
+
+    """
+    current = current_version(fname)
+    for version in versions(fname)[:-keep]:
+        if version == current:
+            continue
+        target = snapshot_name(fname, version)
+        try:
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            else:
+                os.remove(target)
+        except OSError:
+            # Removed by a concurrent writer
+            pass
+
+
+def new_version():
+    """Unique name of a new snapshot.
+
+    """
+    return '%s-%d' % (dt.datetime.now().strftime('%Y%m%dT%H%M%S%f'),
+                      os.getpid())
+
+
+def swap(fname, version):
+    """Atomically make the snapshot current and prune old ones.
+
+    """
+    target = snapshot_name(fname, version)
+    link = '%s.%s.link' % (fname, version)
+    os.symlink(os.path.relpath(target, os.path.dirname(fname)), link)
+    os.rename(link, fname)
+    prune(fname)
+
+
+def read_compression(directory):
+    """Compression settings of all files in the directory.
+
+    """
+    config = os.path.join(directory, compression_file)
+    if not os.path.exists(config):
+        return dict()
+    with open(config) as fobj:
+        return json.load(fobj)
+
+
+def get_compression(fname):
+    """Compression (complib, complevel) configured for the file.
+
+    """
+    directory, name = os.path.split(fname)
+    settings = read_compression(directory)
+    if name in settings:
+        return tuple(settings[name])
+    return default_compression
+
+
+def set_compression(fname, complib, complevel):
+    """Configure compression of new snapshots of the file.
+
+    """
+    directory, name = os.path.split(fname)
+    settings = read_compression(directory)
+    settings[name] = [complib, complevel]
+    config = os.path.join(directory, compression_file)
+    with open(config + '.tmp', 'w') as fobj:
+        json.dump(settings, fobj, indent=4, sort_keys=True)
+    os.rename(config + '.tmp', config)
+
+
+@contextmanager
+def transaction(fname, keep=False, **kwargs):
+    """Write a new snapshot of the file and make it current on success.
+
+    Parameters
+    ----------
+    fname : str
+        File name
+    keep : bool
+        Whether to copy other keys from the current snapshot
+    kwargs : dict
+        Arguments of HDFStore. Compression is taken from
+        the configuration unless complib is given
+
+    Yields
+    ------
+    HDFStore
+        Store open for writing the new snapshot
+
+    """
+    directory = versions_dir(fname)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    version = new_version()
+    target = snapshot_name(fname, version)
+    temp = target + '.tmp'
+    if keep and os.path.exists(fname):
+        shutil.copyfile(fname, temp)
+    if 'complib' not in kwargs:
+        kwargs['complib'], kwargs['complevel'] = get_compression(fname)
+    try:
+        with pd.HDFStore(temp, mode='a', **kwargs) as store:
+            yield store
+    except:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+    os.rename(temp, target)
+    swap(fname, version)
+
+
+@contextmanager
+def directory_transaction(fname):
+    """Write a new snapshot directory and make it current on success.
+
+    Files written together into the directory, e.g. an array and its
+    axes, become current at once.
+
+    Parameters
+    ----------
+    fname : str
+        Name of the directory link, without extension
+
+    Yields
+    ------
+    str
+        Directory of the new snapshot
+
+    """
+    version = new_version()
+    target = snapshot_name(fname, version)
+    temp = target + '.tmp'
+    os.makedirs(temp)
+    try:
+        yield temp
+    except:
+        shutil.rmtree(temp, ignore_errors=True)
+        raise
+    os.rename(temp, target)
+    swap(fname, version)
+
+
+def write(data, fname, key, keep=False, **kwargs):
+    """Write one table to a new snapshot of the file.
+
+    Parameters
+    ----------
+    data : DataFrame
+        Data to write
+    fname : str
+        File name
+    key : str
+        Key of the table in the file
+    keep : bool
+        Whether to copy other keys from the current snapshot
+    kwargs : dict
+        Arguments of HDFStore.put, e.g. format='table'
+
+    """
+    with transaction(fname, keep=keep) as store:
+        store.put(key, data, **kwargs)
+
+
+def read(fname, key, columns=None, start=None, end=None, on='date',
+         version=None, stop=None):
+    """Read the stored dataset.
+
+    Parameters
+    ----------
+    fname : str
+        File name
+    key : str
+        Key of the table in the file
+    columns : list of str, optional
+        Columns to read. All columns if None
+    start, end : date, optional
+        First and last date to read (inclusive)
+    on : str
+        Name of the index level or column with dates, or 'year'
+        for annual data
+    version : str, optional
+        Snapshot to read. The current one if None
+    stop : int, optional
+        Read only the rows of the stored table before this position,
+        e.g. to sample a large table. All rows if None
+
+    """
+    fname = snapshot_name(fname, version)
+    start, end = _bounds(start, end, on)
+    bounded = start is not None or end is not None
+    with pd.HDFStore(fname, mode='r') as store:
+        if store.get_storer(key).is_table:
+            where = None
+            if bounded:
+                where = _where(store, key, on, start, end)
+            if where is not None or not bounded:
+                return store.select(key, columns=columns, where=where,
+                                    stop=stop)
+        data = store.select(key, stop=stop)
+    data = _select(data, on, start, end)
+    if columns is not None:
+        data = data[columns]
+    return data
+
+
+def read_batches(fname, key, columns=None, start=None, end=None,
+                 on='date', version=None, chunksize=10**6):
+    """Read the stored dataset in batches of rows.
+
+    Tables in 'table' format are never loaded completely. Parameters
+    are the same as in 'read'.
+
+    Yields
+    ------
+    DataFrame
+        Batch of at most chunksize rows
+
+    """
+    fname = snapshot_name(fname, version)
+    start, end = _bounds(start, end, on)
+    bounded = start is not None or end is not None
+    with pd.HDFStore(fname, mode='r') as store:
+        if store.get_storer(key).is_table:
+            where = None
+            if bounded:
+                where = _where(store, key, on, start, end)
+            if where is not None or not bounded:
+                for batch in store.select(key, columns=columns, where=where,
+                                          chunksize=chunksize):
+                    yield batch
+                return
+            for batch in store.select(key, chunksize=chunksize):
+                batch = _select(batch, on, start, end)
+                yield batch if columns is None else batch[columns]
+            return
+        # Fixed format can only be read completely
+        data = store.select(key)
+    data = _select(data, on, start, end)
+    if columns is not None:
+        data = data[columns]
+    for first in range(0, data.shape[0], chunksize):
+        yield data.iloc[first:first + chunksize]
+
+
+def row_index(values):
+    """Map every value to the contiguous row ranges where it occurs.
+
+    Parameters
+    ----------
+    values : array
+        Identifiers in the order of stored rows
+
+    Returns
+    -------
+    DataFrame
+        Columns 'start' and 'stop' (exclusive) of every run of equal
+        values, indexed by the value. A value occurs several times if
+        its rows are not contiguous
+
+    """
+    values = np.asarray(values)
+    if values.shape[0] == 0:
+        return pd.DataFrame({'start': [], 'stop': []}, dtype=int)
+    change = np.flatnonzero(values[1:] != values[:-1]) + 1
+    start = np.concatenate([[0], change])
+    stop = np.concatenate([change, [values.shape[0]]])
+    return pd.DataFrame({'start': start, 'stop': stop},
+                        index=pd.Index(values[start]))
+
+
+def coalesce(ranges):
+    """Merge overlapping and adjacent row ranges.
+
+    """
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return merged
+
+
+def read_rows(fname, key, index_key, values, version=None):
+    """Read only the rows of the given identifiers.
+
+    Parameters
+    ----------
+    fname : str
+        File name
+    key : str
+        Key of the 'table' format panel in the file
+    index_key : str
+        Key of the row index built by 'row_index'
+    values : list
+        Identifiers to read
+    version : str, optional
+        Snapshot to read. The current one if None
+
+    """
+    with pd.HDFStore(snapshot_name(fname, version), mode='r') as store:
+        index = store.select(index_key)
+        index = index[index.index.isin(values)]
+        ranges = coalesce(zip(index['start'], index['stop']))
+        if len(ranges) == 0:
+            return store.select(key, stop=0)
+        return pd.concat([store.select(key, start=start, stop=stop)
+                          for start, stop in ranges])
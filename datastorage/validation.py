@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Validation of imported datasets
+
+Rules are declared per dataset as a dictionary:
+
+    keys : list of str
+        Index levels or columns identifying a row. Keys must be unique
+    sorted : bool
+        Whether keys must be sorted (monotonic increasing)
+    ranges : dict
+        Admissible (lower, upper) bounds of columns. Rows outside of
+        the bounds or with missing values are dropped and counted
+    below : dict
+        Strict upper bounds of columns. Rows at or above the bound or
+        with missing values are dropped and counted
+    positive : list of str
+        Columns which must be strictly positive. Other rows are
+        dropped and counted
+    numeric : list of str
+        Columns which must be numeric. Rows with other values, e.g.
+        codes like 'C', are dropped and counted, missing values are kept
+    gap : str
+        Maximum distance between consecutive dates, e.g. '10D'
+    min_ratio : float
+        Minimum ratio of the number of rows to the one of the
+        previous build
+
+Checks are vectorized and work chunk by chunk, keeping only the last
+key and date of the previous chunk, so that a file read in chunks is
+validated without additional passes over the data (see the import of
+CRSP returns). Failing checks raise ValidationError before anything is
+written to the disk.
+
+"""
+from __future__ import print_function, division
+
+import numpy as np
+import pandas as pd
+
+
+__all__ = ['ValidationError', 'Validator', 'validate', 'rules']
+
+
+rules = {
+    'vix_spx': {'keys': ['date'], 'sorted': True,
+                'ranges': {'VIX': (0, 200), 'SPX': (0, np.inf)},
+                'gap': '10D', 'min_ratio': .99},
+    'realized_vol': {'keys': ['date'], 'sorted': True,
+                     'ranges': {'RV': (0, 500)},
+                     'gap': '10D', 'min_ratio': .99},
+    'short_int': {'keys': ['gvkey', 'date'], 'sorted': True,
+                  'min_ratio': .99},
+    'returns_monthly': {'numeric': ['return'],
+                        'positive': ['price', 'shares']},
+    'returns': {'keys': ['SIC', 'CUSIP', 'year'], 'sorted': True,
+                'min_ratio': .99},
+    'dividends': {'keys': ['date'], 'sorted': True,
+                  'ranges': {'rate': (0, 100)},
+                  'gap': '10D', 'min_ratio': .99},
+    'yields': {'keys': ['date', 'days'], 'sorted': True,
+               'below': {'riskfree': 10}, 'min_ratio': .99},
+    # No filter on imp_vol: the forward price of every row is needed
+    # by the volatility surface even if its implied volatility is missing
+    'std_options': {'keys': ['cp_flag', 'date', 'days'], 'sorted': True,
+                    'min_ratio': .99},
+    'spx': {'keys': ['date'], 'sorted': True,
+            'ranges': {'spx': (0, np.inf)}, 'gap': '10D'},
+    'vix': {'keys': ['date'], 'sorted': True,
+            'ranges': {'vix': (0, 200)}, 'gap': '10D'},
+    }
+
+
+class ValidationError(ValueError):
+    """Imported data violates a validation rule.
+
+    """
+    pass
+
+
+def get_values(data, name):
+    """Values of the column or index level.
+
+    """
+    if name in data.columns:
+        return data[name].values
+    return data.index.get_level_values(name).values
+
+
+class Validator(object):
+    """Validate a dataset chunk by chunk.
+
+    Parameters
+    ----------
+    name : str
+        Name of the dataset, used in messages
+    rules : dict
+        Rules as described in the module docstring
+
+    Attributes
+    ----------
+    dropped : dict
+        Number of dropped rows per rule
+    nrows : int
+        Number of rows passed validation so far
+
+    """
+
+    def __init__(self, name, rules):
+        self.name = name
+        self.rules = rules
+        self.dropped = dict()
+        self.nrows = 0
+        self.last_key = None
+        self.last_date = None
+
+    def fail(self, rule, message):
+        raise ValidationError('%s: rule %r failed: %s'
+                              % (self.name, rule, message))
+
+    def check(self, chunk):
+        """Validate the next chunk.
+
+        Returns
+        -------
+        DataFrame
+            Chunk without dropped rows
+
+        """
+        keep = np.ones(chunk.shape[0], dtype=bool)
+        bounds = [('range:' + column, column, lower, upper)
+                  for column, (lower, upper)
+                  in sorted(self.rules.get('ranges', {}).items())]
+        bounds += [('below:' + column, column, -np.inf, upper)
+                   for column, upper
+                   in sorted(self.rules.get('below', {}).items())]
+        bounds += [('positive:' + column, column, 0, np.inf)
+                   for column in self.rules.get('positive', [])]
+        bounds += [('numeric:' + column, column, None, None)
+                   for column in self.rules.get('numeric', [])]
+        for rule, column, lower, upper in bounds:
+            raw = pd.Series(get_values(chunk, column))
+            values = pd.to_numeric(raw, errors='coerce').values
+            if rule.startswith('numeric'):
+                inside = ~np.isnan(values) | raw.isnull().values
+            elif rule.startswith('below'):
+                inside = values < upper
+            else:
+                inside = (values >= lower) & (values <= upper)
+            if rule.startswith('positive'):
+                inside &= values > 0
+            self.dropped[rule] = (self.dropped.get(rule, 0)
+                                  + int((keep & ~inside).sum()))
+            keep &= inside
+        if not keep.all():
+            chunk = chunk[keep]
+
+        keys = self.rules.get('keys')
+        if keys and chunk.shape[0] > 0:
+            self.check_keys(chunk, keys)
+        if 'gap' in self.rules and chunk.shape[0] > 0:
+            self.check_gap(chunk)
+
+        self.nrows += chunk.shape[0]
+        return chunk
+
+    def check_keys(self, chunk, keys):
+        """Check uniqueness and order of keys within and across chunks.
+
+        """
+        index = pd.MultiIndex.from_arrays([get_values(chunk, key)
+                                           for key in keys])
+        first, last = index[0], index[-1]
+        if self.rules.get('sorted', False):
+            if not index.is_monotonic_increasing \
+                    or (self.last_key is not None and first < self.last_key):
+                self.fail('sorted', 'keys %s are not sorted' % keys)
+        if index.has_duplicates \
+                or (self.last_key is not None and first == self.last_key):
+            dup = index[index.duplicated()]
+            self.fail('keys', 'duplicate keys %s, e.g. %s'
+                      % (keys, dup[0] if len(dup) > 0 else first))
+        self.last_key = last
+
+    def check_gap(self, chunk):
+        """Check that consecutive dates are not too far apart.
+
+        """
+        dates = np.unique(get_values(chunk, 'date'))
+        if self.last_date is not None:
+            dates = np.concatenate([[self.last_date], dates])
+        gaps = np.diff(dates)
+        limit = np.timedelta64(pd.Timedelta(self.rules['gap']))
+        if (gaps > limit).any():
+            where = np.flatnonzero(gaps > limit)[0]
+            self.fail('gap', 'no data between %s and %s'
+                      % (dates[where], dates[where + 1]))
+        self.last_date = dates[-1]
+
+    def finish(self, previous=None):
+        """Final checks after the last chunk.
+
+        Parameters
+        ----------
+        previous : int, optional
+            Number of rows in the previous build
+
+        """
+        ratio = self.rules.get('min_ratio')
+        if ratio is not None and previous:
+            if self.nrows < ratio * previous:
+                self.fail('min_ratio', '%d rows compared to %d before'
+                          % (self.nrows, previous))
+        for rule, count in sorted(self.dropped.items()):
+            if count > 0:
+                print('%s: dropped %d rows by rule %r'
+                      % (self.name, count, rule))
+        return self.dropped
+
+
+def previous_rows(fname, key):
+    """Number of rows in the stored table. None if there is no table.
+
+    Reads only metadata.
+
+    """
+    try:
+        with pd.HDFStore(fname, mode='r') as store:
+            if key not in store:
+                return None
+            storer = store.get_storer(key)
+            if storer.is_table:
+                return storer.nrows
+            # Fixed format frames keep the row index in 'axis1'
+            group = storer.group
+            if 'axis1' in group:
+                return group.axis1.shape[0]
+            return group.axis1_label0.shape[0]
+    except IOError:
+        return None
+
+
+def validate(data, name, fname=None, key=None):
+    """Validate the whole dataset in one go.
+
+    Parameters
+    ----------
+    data : DataFrame
+        Dataset to validate
+    name : str
+        Name of the dataset in 'rules'
+    fname, key : str, optional
+        Location of the previous build to compare row counts with
+
+    Returns
+    -------
+    DataFrame
+        Dataset without dropped rows
+
+    """
+    validator = Validator(name, rules[name])
+    data = validator.check(data)
+    previous = None
+    if fname is not None:
+        previous = previous_rows(fname, key)
+    validator.finish(previous)
+    return data
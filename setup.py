@@ -14,6 +14,9 @@ setup(name='datastorage',
       url='https://github.com/khrapovs/datastorage',
       license='MIT',
       packages=find_packages(),
+      entry_points={
+        'console_scripts': ['datastorage = datastorage.cli:main'],
+      },
       zip_safe=False,
       keywords=['data', 'econometrics', 'volatility', 'returns',
                 'options', 'interest', 'rates', 'optionmetrics', 'crsp',